@@ -0,0 +1,234 @@
+"""
+Keystroke-replay load generator for the Scalpel server's /complete endpoint.
+
+Simulates N editors typing spans of corpus files character by character.
+Each editor behaves like lua/scalpel/fetcher.lua: a request is sent once
+typing pauses for the 100 ms debounce, and a response is stale (discarded)
+if a newer request from the same editor was sent before it arrived. Each
+editor is its own server session, so the server aborts superseded requests
+(--no-sessions measures the purely client-side discarding instead).
+
+Usage:
+    python benchmark.py --editors 4
+    python benchmark.py --suite 1,2,4,8,16 --label my-build
+"""
+
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from datetime import datetime
+from pathlib import Path
+
+from evaluator import latency_summary
+from server_client import AsyncScalpelServerClient
+
+# Same debounce as lua/scalpel/fetcher.lua
+DEBOUNCE_S = 0.1
+
+
+class BenchStats:
+    """Request outcomes for one benchmark run."""
+
+    def __init__(self):
+        self.keystrokes = 0
+        self.requests = 0
+        self.errors = 0
+        self.superseded = 0        # Aborted by the server in favour of a newer request
+        self.server_cache_hits = 0 # Answered from the server's response cache
+        self.latencies = []        # Client round trip of every completed request
+        self.server_ms = []        # Server-reported latency of every completed request
+        self.stale = 0
+        self.stale_server_ms = 0.0
+
+    def summary(self, duration_s):
+        completed = len(self.latencies)
+        total_server_ms = sum(self.server_ms)
+        return {
+            'duration_seconds': duration_s,
+            'keystrokes': self.keystrokes,
+            'requests': self.requests,
+            'completed': completed,
+            'errors': self.errors,
+            'superseded': self.superseded,
+            'server_cache_hit_rate': self.server_cache_hits / completed if completed else 0.0,
+            'stale': self.stale,
+            'sustained_qps': completed / duration_s if duration_s > 0 else 0.0,
+            'stale_rate': self.stale / completed if completed else 0.0,
+            # Share of server generation time spent on responses nobody reads
+            'wasted_generation_ratio': self.stale_server_ms / total_server_ms if total_server_ms else 0.0,
+            'latency_ms': latency_summary(self.latencies),
+            'server_latency_ms': latency_summary(self.server_ms),
+        }
+
+
+def pick_spans(basedir, file_list, n_editors, chars, rng):
+    """Choose one (code, start) span per editor, starting at a line boundary."""
+    paths = [p.strip() for p in open(os.path.join(basedir, file_list)) if p.strip()]
+    rng.shuffle(paths)
+
+    spans = []
+    for path in paths:
+        if len(spans) == n_editors:
+            break
+        try:
+            with open(os.path.join(basedir, path), 'r') as f:
+                code = f.read()
+        except (OSError, UnicodeDecodeError):
+            continue
+        if len(code) <= chars:
+            continue
+
+        line_starts = [0] + [i + 1 for i, c in enumerate(code[:len(code) - chars]) if c == '\n']
+        spans.append((path, code, rng.choice(line_starts)))
+
+    if len(spans) < n_editors:
+        raise ValueError(f"Only found {len(spans)} files longer than {chars} chars for {n_editors} editors")
+    return spans
+
+
+async def run_editor(client, document, session, code, start, chars, cps, rng, stats):
+    """Type code[start:start + chars] one character at a time."""
+    end = start + chars
+    suffix = code[end:]
+    latest_seq = 0
+    debounce = None
+    in_flight = set()
+
+    async def fetch(seq, prefix):
+        t0 = time.perf_counter()
+        result = await client.complete(prefix, suffix, document=document, session=session)
+        latency_ms = (time.perf_counter() - t0) * 1000
+
+        if result.status == 409:
+            stats.superseded += 1
+            return
+        if not result.ok:
+            stats.errors += 1
+            return
+        stats.latencies.append(latency_ms)
+        if result.server_cache:
+            stats.server_cache_hits += 1
+        server_ms = result.server_latency_ms or 0.0
+        stats.server_ms.append(server_ms)
+
+        # A newer request was sent while this one was in flight
+        if seq != latest_seq:
+            stats.stale += 1
+            stats.stale_server_ms += server_ms
+
+    async def debounced(prefix):
+        nonlocal latest_seq
+        await asyncio.sleep(DEBOUNCE_S)
+        latest_seq += 1
+        stats.requests += 1
+        # Like fetcher.lua, the client never cancels; the server aborts superseded sessions
+        task = asyncio.create_task(fetch(latest_seq, prefix))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+    for pos in range(start + 1, end + 1):
+        stats.keystrokes += 1
+        if debounce is not None:
+            debounce.cancel()
+        debounce = asyncio.create_task(debounced(code[:pos]))
+        # Jittered typing speed around `cps` characters per second
+        await asyncio.sleep(rng.uniform(0.5, 1.5) / cps)
+
+    await asyncio.gather(debounce, return_exceptions=True)
+    while in_flight:
+        await asyncio.gather(*list(in_flight), return_exceptions=True)
+
+
+async def run_benchmark(args, n_editors):
+    rng = random.Random(args.seed)
+    spans = pick_spans(args.basedir, args.file_list, n_editors, args.chars, rng)
+    stats = BenchStats()
+    # Fresh document ids per run, so the server's response cache can't answer
+    # from an earlier run or invocation typing the same spans
+    run_id = uuid.uuid4().hex[:8]
+
+    async with AsyncScalpelServerClient(server_url=args.server_url, max_connections=n_editors * 4,
+                                        timeout=args.timeout, max_retries=0) as client:
+        if not await client.ping():
+            raise RuntimeError(f"Server at {args.server_url} is not healthy")
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(
+            run_editor(client, f"editor-{run_id}-{i}", None if args.no_sessions else f"editor-{run_id}-{i}",
+                       code, start, args.chars, args.cps, random.Random(args.seed + i), stats)
+            for i, (_, code, start) in enumerate(spans)
+        ))
+        duration_s = time.perf_counter() - t0
+
+    summary = stats.summary(duration_s)
+    summary['editors'] = n_editors
+    summary['files'] = [path for path, _, _ in spans]
+    return summary
+
+
+def print_summary(summary):
+    lat = summary['latency_ms']
+    print(f"  editors={summary['editors']:<3} qps={summary['sustained_qps']:.1f} "
+          f"completed={summary['completed']} errors={summary['errors']} superseded={summary['superseded']} "
+          f"stale={summary['stale_rate']:.1%} wasted={summary['wasted_generation_ratio']:.1%} "
+          f"server-cache={summary['server_cache_hit_rate']:.1%}")
+    if lat['count']:
+        print(f"    latency p50 {lat['p50']:.1f}ms | p90 {lat['p90']:.1f}ms | "
+              f"p99 {lat['p99']:.1f}ms | max {lat['max']:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keystroke-replay benchmark for /complete")
+    parser.add_argument("--server-url", type=str, default="http://localhost:3000")
+    parser.add_argument("--basedir", type=str, default="data/py150/token_completion", help="Corpus base directory")
+    parser.add_argument("--file-list", type=str, default="python100_eval.txt", help="File list relative to basedir")
+    parser.add_argument("--editors", type=int, default=4, help="Concurrent simulated editors")
+    parser.add_argument("--suite", type=str, default=None, help="Comma-separated editor counts to run in turn (e.g. 1,2,4,8)")
+    parser.add_argument("--chars", type=int, default=200, help="Characters typed per editor")
+    parser.add_argument("--cps", type=float, default=8.0, help="Typing speed in characters per second")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=20)
+    parser.add_argument("--no-sessions", action="store_true", help="Don't send session ids (no server-side abort)")
+    parser.add_argument("--label", type=str, default="", help="Server build label stored with the results")
+    parser.add_argument("--output-dir", type=str, default="results")
+    args = parser.parse_args()
+
+    editor_counts = [int(n) for n in args.suite.split(",")] if args.suite else [args.editors]
+
+    print(f"⌨️  Keystroke replay: {args.chars} chars @ {args.cps} cps, debounce {int(DEBOUNCE_S * 1000)}ms")
+    runs = []
+    for n_editors in editor_counts:
+        summary = asyncio.run(run_benchmark(args, n_editors))
+        print_summary(summary)
+        runs.append(summary)
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'label': args.label,
+        'server_url': args.server_url,
+        'config': {
+            'chars': args.chars,
+            'cps': args.cps,
+            'debounce_ms': int(DEBOUNCE_S * 1000),
+            'seed': args.seed,
+            'sessions': not args.no_sessions,
+            'file_list': args.file_list,
+        },
+        'runs': runs,
+    }
+
+    out_dir = Path(args.output_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    label = f"_{args.label}" if args.label else ""
+    out_path = out_dir / f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}{label}.json"
+    with open(out_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Benchmark saved to: {out_path}")
+
+
+if __name__ == "__main__":
+    main()
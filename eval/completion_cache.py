@@ -0,0 +1,104 @@
+"""
+Content-addressed on-disk cache of server completions.
+
+The server is deterministic (temperature 0, fixed seed), so a completion is
+fully determined by the prompt inputs, the server build and its
+configuration. Entries are keyed on a hash of all of them and stored in
+SQLite. Hits replay the stored result without timing anything, so they are
+kept out of latency statistics.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional, List
+
+
+def model_identity(model_path: str) -> str:
+    """Identify a model file by name and size (hashing a GGUF is too slow)."""
+    try:
+        size = os.path.getsize(model_path)
+    except (OSError, TypeError):
+        size = -1
+    return f"{os.path.basename(model_path or '')}:{size}"
+
+
+def server_identity(binary_path: str) -> str:
+    """Identify a server build by its binary's size and modification time."""
+    try:
+        st = os.stat(binary_path)
+        return f"{os.path.basename(binary_path)}:{st.st_size}:{int(st.st_mtime)}"
+    except OSError:
+        return f"{os.path.basename(binary_path or '')}:missing"
+
+
+class CompletionCache:
+    def __init__(self, path: str, model_path: str, max_context, max_predict, stop_tokens: List[str],
+                 server: str = "", split_ratio=None):
+        """
+        Open (or create) a cache database.
+
+        Args:
+            path: SQLite database file
+            model_path: GGUF model the server was started with
+            max_context: Server context window
+            max_predict: Server max tokens to predict
+            stop_tokens: Stop tokens used for generation
+            server: Identity of the server build (see server_identity)
+            split_ratio: Per-request prefix share of the budget (None for the server default)
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, result TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self.conn.commit()
+        # Evaluation workers share one connection
+        self._lock = threading.Lock()
+
+        self._config = json.dumps([
+            model_identity(model_path),
+            str(max_context),
+            str(max_predict),
+            list(stop_tokens),
+            server,
+            str(split_ratio),
+        ]).encode("utf-8")
+
+    def key(self, prefix: str, suffix: str) -> str:
+        """Hash of (prefix, suffix, model file, max_context, max_predict, stop tokens, server build, split ratio)."""
+        h = hashlib.sha256(self._config)
+        for part in (prefix, suffix):
+            data = part.encode("utf-8")
+            # Length-prefix each part so (prefix, suffix) boundaries are unambiguous
+            h.update(f"\0{len(data)}:".encode("ascii"))
+            h.update(data)
+        return h.hexdigest()
+
+    def get(self, prefix: str, suffix: str) -> Optional[dict]:
+        """Return the cached result for these inputs, or None."""
+        key = self.key(prefix, suffix)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT result FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, prefix: str, suffix: str, result: dict):
+        """Store a (successful) result for these inputs."""
+        key = self.key(prefix, suffix)
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO completions (key, result, created) VALUES (?, ?, ?)",
+                (key, json.dumps(result), time.time()),
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -1,15 +1,154 @@
 import os
-import json
-from tokenize import tokenize, ENCODING, ENDMARKER, COMMENT
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from tokenize import tokenize, ENCODING, ENDMARKER, COMMENT, NAME, NUMBER, STRING, OP
 from io import BytesIO
+from token_store import TokenStore
+from parallel import ordered_map
+
+# Python files kept in flight per worker while streaming
+PYTHON_FILES_PER_WORKER = 16
+
+# Lines of dev.txt per worker task when streaming
+JAVA_CHUNK_SIZE = 64
+
+# Chunks kept in flight per worker, so none idles waiting for the next task
+JAVA_CHUNKS_PER_WORKER = 4
+
+# javalang token classes -> Python tokenize types, so both languages emit
+# the same {value, start_pos, type} records
+JAVA_TOKEN_TYPES = {
+    'Identifier': NAME,
+    'Keyword': NAME,
+    'BasicType': NAME,
+    'Modifier': NAME,
+    'Boolean': NAME,
+    'Null': NAME,
+    'String': STRING,
+    'Character': STRING,
+}
+
+
+def _line_offsets(code):
+    """Character offset of the start of every line (index 0 is line 1)."""
+    offsets = [0]
+    pos = code.find('\n')
+    while pos != -1:
+        offsets.append(pos + 1)
+        pos = code.find('\n', pos + 1)
+    return offsets
+
+
+def _tokenize_python_file(task):
+    """Tokenize one file. Module-level so it can run in a worker process."""
+    basedir, path = task
+    try:
+        code = open(os.path.join(basedir, path)).read()
+        token_gen = tokenize(BytesIO(bytes(code, "utf8")).readline)
+
+        # One offset index per file: (line, col) -> start_pos is O(1)
+        line_offsets = _line_offsets(code)
+
+        file_tokens = []
+        for toknum, tokval, start, end, line in token_gen:
+            tokval = " ".join(tokval.split())
+
+            if toknum in [ENCODING, ENDMARKER, COMMENT] or len(tokval) == 0:
+                continue
+
+            start_line, start_col = start
+
+            file_tokens.append({
+                'value': tokval,
+                'start_pos': line_offsets[start_line - 1] + start_col,
+                'type': toknum
+            })
+
+        return {
+            'file': path,
+            'token_count': len(file_tokens),
+            'tokens': file_tokens
+        }
+
+    except Exception as e:
+        print(f"Tokenization error: {e}")
+        return None
+
+
+def _tokenize_java_line(task):
+    """
+    Tokenize one javaCorpus line (one source file per line).
+
+    The line is written out as a standalone .java file so the LSP can open
+    it, and token offsets are character positions into that file.
+    """
+    basedir, out_path, line = task
+    import javalang  # Same dependency as data/javaCorpus/preprocess.py
+
+    code = line.strip()
+    if code.startswith("<s>"):
+        code = code[len("<s>"):]
+    if code.endswith("</s>"):
+        code = code[:-len("</s>")]
+    code = code.strip()
+
+    try:
+        java_tokens = list(javalang.tokenizer.tokenize(code))
+    except Exception as e:
+        print(f"Tokenization error: {e}")
+        return None
+
+    if not java_tokens:
+        return None
+
+    # Tokens appear in source order, so a single forward scan gives offsets
+    file_tokens = []
+    cursor = 0
+    for tok in java_tokens:
+        tokval = tok.value
+        start_pos = code.find(tokval, cursor)
+        if start_pos == -1:
+            continue
+        cursor = start_pos + len(tokval)
+
+        tok_class = type(tok).__name__
+        if tok_class in JAVA_TOKEN_TYPES:
+            toknum = JAVA_TOKEN_TYPES[tok_class]
+        elif isinstance(tok, javalang.tokenizer.Literal):
+            toknum = NUMBER
+        else:
+            toknum = OP
+
+        file_tokens.append({
+            'value': tokval,
+            'start_pos': start_pos,
+            'type': toknum
+        })
+
+    with open(os.path.join(basedir, out_path), 'w') as f:
+        f.write(code)
+
+    return {
+        'file': out_path,
+        'token_count': len(file_tokens),
+        'tokens': file_tokens
+    }
+
+
+def _tokenize_java_chunk(tasks):
+    """Tokenize a chunk of javaCorpus lines in one worker task."""
+    return [_tokenize_java_line(task) for task in tasks]
+
 
 class DataLoader:
-    def __init__(self, basedir, infile, outfile, language):
+    def __init__(self, basedir, infile, outfile, language, num_workers=None):
         self.basedir = basedir
         self.infile = infile
         self.outfile = outfile
         self.tokens = []
         self.language = language
+        # Worker processes for tokenization (None = one per CPU, 1 = serial)
+        self.num_workers = num_workers
 
     def tokenize_data(self):
         if self.language == "python":
@@ -19,67 +158,69 @@ class DataLoader:
         else:
             raise ValueError(f"Unsupported language: {self.language}")
 
-    def tokenize_data_java(self): 
-        
-        pass
+    def tokenize_data_java(self):
+        # Each line of the corpus file is one source file; materialize them
+        # under <split>_files/ so they can be opened by the LSP later
+        split = os.path.splitext(os.path.basename(self.infile))[0]
+        files_dir = f"{split}_files"
+        os.makedirs(os.path.join(self.basedir, files_dir), exist_ok=True)
+
+        with open(os.path.join(self.basedir, self.infile)) as f:
+            # Stream the corpus instead of reading it all into memory, and
+            # yield results so they go straight into the token store
+            tasks = (
+                (self.basedir, os.path.join(files_dir, f"{idx}.java"), line)
+                for idx, line in enumerate(f)
+            )
+
+            if self.num_workers == 1:
+                for r in map(_tokenize_java_line, tasks):
+                    if r is not None:
+                        yield r
+                return
+
+            # A sliding window of chunks instead of batch barriers: a new
+            # chunk is submitted as soon as the oldest one is collected
+            chunks = iter(lambda: list(islice(tasks, JAVA_CHUNK_SIZE)), [])
+            window = (self.num_workers or os.cpu_count() or 1) * JAVA_CHUNKS_PER_WORKER
+            with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                for results in ordered_map(executor, _tokenize_java_chunk, chunks, window):
+                    for r in results:
+                        if r is not None:
+                            yield r
 
     def tokenize_data_python(self):
-        file_paths = open(os.path.join(self.basedir, self.infile)).readlines()
-        files_with_tokens = []
-        for ct, path in enumerate(file_paths):
-            try:
-                # print(path)
-                code = open(os.path.join(self.basedir, path.strip())).read()
-                token_gen = tokenize(BytesIO(bytes(code, "utf8")).readline)
-                
-                file_tokens = []
-                for toknum, tokval, start, end, line in token_gen:
-                    tokval = " ".join(tokval.split())
-                    
-                    if toknum in [ENCODING, ENDMARKER, COMMENT] or len(tokval) == 0:
-                        continue
-                    
-                    start_line, start_col = start
-                    
-                    # Convert (line, col) to character position
-                    lines = code.split('\n')
-                    char_pos = sum(len(l) + 1 for l in lines[:start_line-1])
-                    char_pos += start_col
-                    
-                    file_tokens.append({
-                        'value': tokval,
-                        'start_pos': char_pos,
-                        'type': toknum
-                    })
-
-                files_with_tokens.append({
-                    'file': path.strip(),
-                    'token_count': len(file_tokens),
-                    'tokens': file_tokens
-                })
-
-            except Exception as e:
-                print(f"Tokenization error: {e}")
-
-        return files_with_tokens
+        with open(os.path.join(self.basedir, self.infile)) as f:
+            # Yield per file, like the Java path, so results stream straight
+            # into the token store instead of building the corpus in memory
+            tasks = ((self.basedir, path) for path in (line.strip() for line in f) if path)
 
-    def get_data(self):
-        token_path = self.outfile
-        if os.path.exists(token_path):            
-            with open(token_path, 'r') as f:
-                files_with_tokens = json.load(f)
+            if self.num_workers == 1:
+                for r in map(_tokenize_python_file, tasks):
+                    if r is not None:
+                        yield r
+                return
 
-            total_tokens = sum(f['token_count'] for f in files_with_tokens)
-            print(f"Loaded {len(files_with_tokens)} files with {total_tokens} total tokens from {token_path}")
+            # Shard files across worker processes. ordered_map yields results
+            # in input order, so the output is identical to a serial run.
+            window = (self.num_workers or os.cpu_count() or 1) * PYTHON_FILES_PER_WORKER
+            with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                for r in ordered_map(executor, _tokenize_python_file, tasks, window):
+                    if r is not None:
+                        yield r
 
-        else:            
-            files_with_tokens = self.tokenize_data()
-            
-            # Save to JSON
-            with open(token_path, 'w') as f:
-                json.dump(files_with_tokens, f, indent=2)
+    def get_data(self):
+        token_path = self.outfile
+        created = not TokenStore.exists(token_path)
+        if created:
+            # Tokenizer results are generators and stream straight into the store
+            TokenStore.write(token_path, self.tokenize_data())
 
-            total_tokens = sum(f['token_count'] for f in files_with_tokens)
-            print(f"Saved {len(files_with_tokens)} files with {total_tokens} total tokens to {token_path}")
+        # Always hand out the memory-mapped store so tokens are loaded per file
+        store = TokenStore(token_path)
+        if created:
+            print(f"Saved {len(store)} files with {store.total_tokens} total tokens to {token_path}")
+        else:
+            print(f"Loaded {len(store)} files with {store.total_tokens} total tokens from {token_path}")
 
-        return files_with_tokens
\ No newline at end of file
+        return store
@@ -12,12 +12,14 @@ from server_client import ScalpelServerClient
 from dataloader import DataLoader
 from sample_generator import SampleGenerator
 from evaluator import CompletionEvaluator
+from completion_cache import CompletionCache, server_identity
 
 random.seed(20)
 
 # Server configuration  
 SERVER_URL = "http://localhost:3000"
 MODEL_PATH = "../models/qwen2.5-coder-3b-instruct-q4_k_m.gguf"  # For server env var
+MAX_PREDICT = "10"
 
 
 BASE_DIR = "."
@@ -50,9 +52,14 @@ def kill_process_on_port(port):
     except Exception as e:
         print(f"  Error killing process on port {port}: {e}")
 
-def start_server(context_window="1024"):
+def start_server(context_window="1024", reuse=False):
     """Start the Rust server and wait for it to be ready."""
     global server_process
+
+    # Context sweeps can share one warm server: the window is sent per request
+    if reuse and ScalpelServerClient(server_url=SERVER_URL).ping():
+        print("\n♻️  Reusing running Rust server")
+        return True
     
     print("\n🚀 Starting Rust server...")
     
@@ -73,7 +80,7 @@ def start_server(context_window="1024"):
     # Use provided context window (handle "unknown" case)
     ctx = context_window if context_window != "unknown" else "1024"
     env["SCALPEL_MAX_CONTEXT"] = ctx
-    env["SCALPEL_MAX_PREDICT"] = "10"
+    env["SCALPEL_MAX_PREDICT"] = MAX_PREDICT
     env["SCALPEL_THREADS"] = "4"
     env["SCALPEL_GPU_LAYERS"] = "-1"
     
@@ -158,7 +165,7 @@ CONFIGS = {
     "python": {
         "base_dir": os.path.join(BASE_DIR, "data/py150/token_completion"),
         "input_file": "python100_eval.txt",
-        "output_file": os.path.join(BASE_DIR, "data/py150/eval_tokens_python.json"),
+        "output_file": os.path.join(BASE_DIR, "data/py150/eval_tokens_python"),
         "samples_file": os.path.join(BASE_DIR, "data/py150/samples.json"),
         "language_id": "python",
         "lsp_cmd": ["pylsp"]
@@ -166,7 +173,7 @@ CONFIGS = {
     "java": {
         "base_dir": os.path.join(BASE_DIR, "data/javaCorpus/token_completion"),
         "input_file": "dev.txt",
-        "output_file": os.path.join(BASE_DIR, "data/javaCorpus/eval_tokens_java.json"),
+        "output_file": os.path.join(BASE_DIR, "data/javaCorpus/eval_tokens_java"),
         "samples_file": os.path.join(BASE_DIR, "data/javaCorpus/samples.json"),
         "language_id": "java",
         "lsp_cmd": ["jdtls"]
@@ -179,13 +186,24 @@ def main():
     parser.add_argument("--lang", type=str, default="python", choices=["python", "java"], help="Language to evaluate")
     parser.add_argument("--context-window", type=str, default="512", help="Context window size (e.g. 512, 1024)")
     parser.add_argument("--n-samples", type=int, default=-1, help="Number of samples to evaluate (-1 for all)")
+    parser.add_argument("--server-context", type=str, default=None,
+                        help="ctx size to load the server with; --context-window is then sent per request")
+    parser.add_argument("--reuse-server", action="store_true",
+                        help="Use an already running server instead of restarting it")
+    parser.add_argument("--cache", type=str, default=None, metavar="PATH",
+                        help="Reuse completions from this on-disk cache (SQLite); hits are excluded from latency stats")
+    parser.add_argument("--resume", type=str, default=None, metavar="DIR", help="Resume an interrupted run from its results directory")
+    parser.add_argument("--concurrency", type=int, default=1, help="In-flight completion requests during evaluation")
+    parser.add_argument("--lsp-shards", type=int, default=1, help="LSP server processes used for sample generation")
+    parser.add_argument("--num-workers", type=int, default=None, help="Worker processes for tokenization (default: one per CPU)")
     args = parser.parse_args()
     
     config = CONFIGS[args.lang]
     print(f"Starting evaluation for {args.lang}...")
     
     # 0. Start Server (if needed)
-    start_server(args.context_window)
+    per_request_context = args.server_context is not None or args.reuse_server
+    start_server(args.server_context or args.context_window, reuse=args.reuse_server)
 
     # 1. Initialize LSP Client
     print(f"🚀 Initializing LSP Client for {args.lang}...")
@@ -203,6 +221,7 @@ def main():
         infile=config["input_file"],
         outfile=config["output_file"],
         language=config["language_id"],
+        num_workers=args.num_workers,
     )
     data = loader.get_data()
     
@@ -212,25 +231,48 @@ def main():
         basedir=config["base_dir"], 
         samples_file=config["samples_file"],
     )
-    samples = generator.get_samples(data, lsp_client, regenerate=False)
+    samples = generator.get_samples(
+        data, lsp_client, regenerate=False,
+        num_shards=args.lsp_shards,
+        lsp_cmd=config["lsp_cmd"],
+        root_uri=os.path.abspath(config["base_dir"]),
+    )
     
     # 4. Initialize Model Client (Scalpel Server)
     print("🤖 Connecting to Scalpel Server...")
     model = ScalpelServerClient(
-        model_path=os.environ.get("SCALPEL_MODEL_PATH")
+        model_path=os.environ.get("SCALPEL_MODEL_PATH"),
+        pool_size=max(args.concurrency, 1),
+        max_context=args.context_window if per_request_context else None,
     )
     
+    cache = None
+    if args.cache:
+        # A reused server may have been started with a different model
+        model_path = os.environ.get("SCALPEL_MODEL_PATH", MODEL_PATH) if args.reuse_server else MODEL_PATH
+        cache = CompletionCache(
+            args.cache,
+            model_path=os.path.abspath(model_path),
+            max_context=args.context_window,
+            max_predict=MAX_PREDICT,
+            stop_tokens=STOP_TOKENS,
+            server=server_identity(os.path.abspath("../server/target/release/scalpel")),
+        )
+        print(f"🗄️  Using completion cache {args.cache}")
+
     # 5. Evaluate
     print("📊 Starting Evaluation...")
     evaluator = CompletionEvaluator(
         model=model,
         lsp=lsp_client,
         basedir=config["base_dir"],
-        context_window=args.context_window
+        context_window=args.context_window,
+        cache=cache,
     )
 
     # Evaluate all samples
-    evaluator.evaluate_vs_baseline(samples=samples, n=args.n_samples, save_results=True)
+    evaluator.evaluate_vs_baseline(samples=samples, n=args.n_samples, save_results=True,
+                                   concurrency=args.concurrency, resume_dir=args.resume)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -2,43 +2,263 @@ import os
 import json
 import time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict, deque
+from itertools import groupby
 from pathlib import Path
+import numpy as np
+from source_store import SourceStore
+from server_client import CompletionResult
+
+LATENCY_PERCENTILES = (50, 90, 99)
+
+# Upper bucket edges (ms) for latency histograms; the last bucket is open-ended
+LATENCY_HISTOGRAM_EDGES_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def latency_summary(values):
+    """Distribution summary (mean, percentiles, max, histogram) of latencies in ms."""
+    if not values:
+        return {'count': 0}
+
+    arr = np.asarray(values, dtype=float)
+    summary = {'count': len(values), 'mean': float(arr.mean())}
+    for p in LATENCY_PERCENTILES:
+        summary[f'p{p}'] = float(np.percentile(arr, p))
+    summary['max'] = float(arr.max())
+
+    counts = np.bincount(np.searchsorted(LATENCY_HISTOGRAM_EDGES_MS, arr, side='left'),
+                         minlength=len(LATENCY_HISTOGRAM_EDGES_MS) + 1)
+    labels = [f"<={edge}" for edge in LATENCY_HISTOGRAM_EDGES_MS] + [f">{LATENCY_HISTOGRAM_EDGES_MS[-1]}"]
+    summary['histogram'] = dict(zip(labels, counts.tolist()))
+    return summary
+
+
+def context_bucket(n_chars):
+    """Power-of-two bucket label for a prompt length in characters (e.g. '2k-4k')."""
+    if n_chars < 1024:
+        return "<1k"
+    low = 1 << (n_chars.bit_length() - 1)
+    return f"{low // 1024}k-{2 * low // 1024}k"
+
+
+class LatencyBreakdown:
+    """
+    Collects per-sample latencies and splits them by where the time went.
+
+    Client round-trip time is split into server-reported time and the
+    network/queue overhead around it; server stage timings, files and
+    prompt lengths get their own distributions.
+    """
+
+    def __init__(self):
+        self.client = []
+        self.server = []
+        self.overhead = []
+        self.stages = defaultdict(list)
+        self.by_file = defaultdict(list)
+        self.by_context = defaultdict(list)
+
+    def add(self, file, context_chars, client_ms, server_ms=None, timings=None):
+        self.client.append(client_ms)
+        self.by_file[file].append(client_ms)
+        self.by_context[context_bucket(context_chars)].append(client_ms)
+
+        if server_ms is not None:
+            self.server.append(server_ms)
+            self.overhead.append(max(client_ms - server_ms, 0.0))
+        for stage, ms in (timings or {}).items():
+            if ms is not None:
+                self.stages[stage].append(ms)
+
+    def summary(self):
+        return {
+            'client_ms': latency_summary(self.client),
+            'server_ms': latency_summary(self.server),
+            'overhead_ms': latency_summary(self.overhead),
+            'stages': {stage: latency_summary(v) for stage, v in self.stages.items()},
+            'by_file': {f: latency_summary(v) for f, v in sorted(self.by_file.items())},
+            'by_context_chars': {
+                bucket: latency_summary(self.by_context[bucket])
+                for bucket in sorted(self.by_context, key=lambda b: 0 if b == "<1k" else int(b.split('k')[0]))
+            },
+        }
+
+
+# Force streamed sample results to disk every N samples or S seconds
+FSYNC_EVERY = 50
+FSYNC_INTERVAL_S = 5.0
+
+
+class EvalTally:
+    """Running aggregates over per-sample records (fresh or replayed from disk)."""
+
+    def __init__(self):
+        self.n_total = 0
+        self.n_correct_lsp = 0
+        self.n_correct_scalpel = 0
+        self.n_scalpel_used = 0
+        self.total_latency_ms = 0.0
+        self.n_timed = 0            # Samples actually sent to the server (not cache hits)
+        self.cache_hits = 0
+        self.server_cache_hits = 0  # Answered from the server's response cache
+        self.latency = LatencyBreakdown()
+
+    def add(self, record):
+        self.n_total += 1
+        self.n_correct_lsp += record['lsp_correct']
+        self.n_correct_scalpel += record['scalpel_correct']
+        self.n_scalpel_used += record['used_llm']
+        self.server_cache_hits += record.get('server_cache') is not None
+        # Cache hits replay latencies from an earlier run, possibly of another build
+        if record.get('cache_hit', False):
+            self.cache_hits += 1
+            return
+        self.n_timed += 1
+        self.total_latency_ms += record['latency_ms']
+        self.latency.add(record['file'], record['context_chars'], record['latency_ms'],
+                         record['server_latency_ms'], record['timings'])
+
 
 class CompletionEvaluator:
-    def __init__(self, model: 'LocalCodeModel', lsp: 'LSPClient', basedir: str, context_window: str = "unknown"):
+    def __init__(self, model: 'LocalCodeModel', lsp: 'LSPClient', basedir: str, context_window: str = "unknown",
+                 cache: 'CompletionCache' = None):
         self.model = model
         self.lsp = lsp
         self.basedir = basedir
         self.context_window = context_window
+        self.sources = SourceStore(basedir)
+        # Optional on-disk completion cache; hits replay the stored latencies
+        self.cache = cache
     
-    def _save_results(self, results, detailed_samples):
-        """Create results directory and save data."""
+    def _create_save_dir(self, n):
+        """Create the results directory up front so samples can stream into it."""
         # Create descriptive folder name
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
         # Extract short model name from path
-        model_short = Path(results['model_path']).stem[:20]  # Get filename without extension
-        n = results['n_samples']
+        model_short = Path(self.model.model_path).stem[:20]  # Get filename without extension
         
         folder_name = f"{timestamp}_{model_short}_ctx{self.context_window}_n{n}"
         save_dir = Path("results") / folder_name
         save_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Save summary results
-        with open(save_dir / "results.json", 'w') as f:
+        return save_dir
+
+    def _save_results(self, save_dir, results):
+        """Save summary results (per-sample results are already streamed)."""
+        with open(Path(save_dir) / "results.json", 'w') as f:
             json.dump(results, f, indent=2)
-        
-        # Save detailed per-example results (LLM completions only)
-        with open(save_dir / "samples.jsonl", 'w') as f:
-            for sample in detailed_samples:
-                f.write(json.dumps(sample) + '\n')
-        
-        return str(save_dir)
+
+    @staticmethod
+    def _load_stream(save_dir, tally):
+        """
+        Replay samples.jsonl into `tally`; returns the evaluated sample ids.
+
+        A torn final line from an interrupted run is cut off, so records
+        appended by the resumed run start on a line of their own.
+        """
+        done = set()
+        stream_path = Path(save_dir) / "samples.jsonl"
+        if not stream_path.exists():
+            return done
+
+        complete_bytes = 0
+        with open(stream_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # Torn final line
+                complete_bytes += len(line)
+                try:
+                    record = json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    continue
+                if record['sample_id'] in done:
+                    continue
+                done.add(record['sample_id'])
+                tally.add(record)
+
+        if complete_bytes < stream_path.stat().st_size:
+            os.truncate(stream_path, complete_bytes)
+        return done
      
-    def evaluate_vs_baseline(self, samples, n: int = -1, save_results: bool = False):
+    def _predict(self, sample):
+        """Query the model for one sample; returns (CompletionResult, client latency_ms)."""
+        code_before, code_after = self.sources.context(sample)
+
+        if self.cache:
+            cached = self.cache.get(code_before, code_after)
+            if cached is not None:
+                result = CompletionResult(
+                    completion=cached['completion'],
+                    server_latency_ms=cached['server_latency_ms'],
+                    timings=cached['timings'],
+                    cached=True,
+                )
+                return result, cached['latency_ms']
+
+        start_time = time.perf_counter()
+        result = self.model.complete(code_before=code_before, code_after=code_after)
+        end_time = time.perf_counter()
+        latency_ms = (end_time - start_time) * 1000
+
+        if self.cache and result.ok:
+            self.cache.put(code_before, code_after, {
+                'completion': result.completion,
+                'latency_ms': latency_ms,
+                'server_latency_ms': result.server_latency_ms,
+                'timings': result.timings,
+            })
+
+        return result, latency_ms
+
+    def _predict_file(self, file_samples):
+        """Query one file's samples in order on the calling worker."""
+        return [self._predict(sample) for sample in file_samples]
+
+    def _predictions(self, samples, concurrency: int = 1):
+        """
+        Yield (CompletionResult, latency_ms) for each sample, in input order.
+
+        With concurrency > 1, consecutive samples from the same file form one
+        task so they stay in order on a single worker (KV-cache locality),
+        while different files run in parallel on a bounded thread pool.
+        """
+        if concurrency <= 1:
+            for sample in samples:
+                yield self._predict(sample)
+            return
+
+        # Only a bounded window of file groups is submitted ahead of the
+        # consumer, so stopping early leaves little queued work behind
+        file_groups = (list(group) for _, group in groupby(samples, key=lambda x: x['file']))
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        pending = deque()
+        try:
+            for group in file_groups:
+                pending.append(executor.submit(self._predict_file, group))
+                if len(pending) >= concurrency * 2:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            # On early exit, drop queued groups instead of waiting for them
+            executor.shutdown(wait=False, cancel_futures=True)
+     
+    def evaluate_vs_baseline(self, samples, n: int = -1, save_results: bool = False, concurrency: int = 1,
+                             resume_dir: str = None, save_dir: str = None):
         """
         Compare LSP baseline vs Scalpel (threshold=0).
         Evaluates exactly n samples with valid LSP completions.
+
+        Args:
+            concurrency: Number of in-flight model requests. Results are
+                consumed in sample order, so accuracy and samples.jsonl
+                match a serial run.
+            resume_dir: Results directory of an interrupted run. Samples
+                already in its samples.jsonl are skipped and aggregates are
+                recomputed from the stream.
+            save_dir: Directory to save results in, instead of a new
+                timestamped one under results/ (implies save_results).
         """
         if n <= 0:
             n = len(samples)
@@ -47,101 +267,121 @@ class CompletionEvaluator:
             
         # Sort samples by file to maximize prompt caching
         # (Processing same file sequentially allows server to reuse KV cache)
+        # The sort is stable, so sample ids are the same across resumed runs
         samples.sort(key=lambda x: x['file'])
-        
-        n_correct_lsp = 0
-        n_correct_scalpel = 0
-        n_scalpel_used = 0
-        n_total = 0
-        sample_idx = 0
-        total_latency_ms = 0.0 
-        detailed_samples = []  # Track per-example details
+        selected = samples[:n]
+
+        tally = EvalTally()
+        done = set()
+        if resume_dir:
+            save_dir = Path(resume_dir)
+            done = self._load_stream(save_dir, tally)
+            print(f"↻ Resuming {save_dir}: {len(done)}/{n} samples already evaluated")
+        elif save_dir:
+            save_dir = Path(save_dir)
+            save_dir.mkdir(parents=True, exist_ok=True)
+        elif save_results:
+            save_dir = self._create_save_dir(n)
+
+        # Every evaluated sample is appended as soon as it completes
+        stream = open(save_dir / "samples.jsonl", 'a' if resume_dir else 'w') if save_dir else None
+        last_fsync = time.time()
+        n_resumed = len(done)
     
         eval_start_time = time.time()
 
-        while n_total < n:
-            if sample_idx >= len(samples):
-                print(f"Warning: Ran out of samples. Only processed {n_total}/{n}")
-                break
-            
-            sample = samples[sample_idx]
-            sample_idx += 1
-            
-            code_before = sample['code_before']
-            code_after = sample['code_after']
-            label = sample['target_token']
-            lsp_position = sample['lsp_position']
-            
-            # Use pre-stored LSP completion from sample (deterministic, no re-querying needed)
-            lsp_prediction = sample['lsp_completion']
-            
-            print(f"\n{'='*70}")
-            print(f"Sample {n_total + 1}/{n}")
-            print(f"File: {sample['file']}")
-            print(f"Target: {label}")
-            print(f"LSP prediction (pre-stored): {lsp_prediction}")
-            
-            # Get Scalpel prediction (RAW - no filtering)
-            start_time = time.perf_counter()
-            llm_completion = self.model.generate(code_before=code_before, code_after=code_after)
-            
-            end_time = time.perf_counter()
+        pending = [sample for sample_id, sample in enumerate(selected) if sample_id not in done]
+        predictions = self._predictions(pending, concurrency)
 
-            latency_ms = (end_time - start_time) * 1000
-            total_latency_ms += latency_ms
-            
+        try:
+            for sample_id, sample in enumerate(selected):
+                if sample_id in done:
+                    continue
+                
+                code_before, code_after = self.sources.context(sample)
+                label = sample['target_token']
+                
+                # Use pre-stored LSP completion from sample (deterministic, no re-querying needed)
+                lsp_prediction = sample['lsp_completion']
+                
+                print(f"\n{'='*70}")
+                print(f"Sample {sample_id + 1}/{n}")
+                print(f"File: {sample['file']}")
+                print(f"Target: {label}")
+                print(f"LSP prediction (pre-stored): {lsp_prediction}")
+                
+                # Get Scalpel prediction (RAW - no filtering)
+                result, latency_ms = next(predictions)
 
-            if llm_completion:
-                scalpel_prediction = llm_completion
-                n_scalpel_used += 1
-                used_llm = True
-                print(f"Scalpel prediction: {scalpel_prediction} (from LLM)")
-            else:
-                scalpel_prediction = lsp_prediction
-                used_llm = False
-                print(f"Scalpel prediction: {scalpel_prediction} (fallback to LSP)")
-
-            print(f"Latency: {latency_ms:.1f}ms")
-
-            # Check correctness
-            lsp_correct = lsp_prediction == label
-            scalpel_correct = scalpel_prediction == label
-            
-            if lsp_correct:
-                n_correct_lsp += 1
-                print("✓ LSP correct")
-            
-            if scalpel_correct:
-                n_correct_scalpel += 1
-                print("✓ Scalpel correct")
-            
-            # Store detailed sample info (only for LLM completions, not LSP fallbacks)
-            if used_llm:
-                detailed_samples.append({
-                    'sample_id': n_total,
+                if result.ok and result.completion:
+                    scalpel_prediction = result.completion
+                    used_llm = True
+                    print(f"Scalpel prediction: {scalpel_prediction} (from LLM)")
+                else:
+                    if not result.ok:
+                        print(f"Request failed: {result.error}")
+                    scalpel_prediction = lsp_prediction
+                    used_llm = False
+                    print(f"Scalpel prediction: {scalpel_prediction} (fallback to LSP)")
+
+                print(f"Latency: {latency_ms:.1f}ms")
+
+                # Check correctness
+                lsp_correct = lsp_prediction == label
+                scalpel_correct = scalpel_prediction == label
+                
+                if lsp_correct:
+                    print("✓ LSP correct")
+                if scalpel_correct:
+                    print("✓ Scalpel correct")
+                
+                record = {
+                    'sample_id': sample_id,
                     'file': sample['file'],
                     'trigger_token': sample.get('trigger_token', ''),
                     'target_token': label,
                     'target_position': sample['lsp_position'],
                     'lsp_prediction': lsp_prediction,
                     'lsp_correct': lsp_correct,
+                    'used_llm': used_llm,
                     'scalpel_prediction': scalpel_prediction,
                     'scalpel_correct': scalpel_correct,
                     'latency_ms': round(latency_ms, 2),
+                    'server_latency_ms': result.server_latency_ms,
+                    'timings': result.timings,
+                    'cache_hit': result.cached,
+                    'server_cache': result.server_cache,
+                    'context_chars': len(code_before) + len(code_after),
                     'code_before_preview': code_before[-100:] if len(code_before) > 100 else code_before,
                     'code_after_preview': code_after[:100] if len(code_after) > 100 else code_after,
-                })
-            
-            n_total += 1  # Only increment when we successfully evaluate
+                }
+                tally.add(record)
+
+                if stream:
+                    stream.write(json.dumps(record) + '\n')
+                    stream.flush()
+                    if tally.n_total % FSYNC_EVERY == 0 or time.time() - last_fsync > FSYNC_INTERVAL_S:
+                        os.fsync(stream.fileno())
+                        last_fsync = time.time()
+        finally:
+            predictions.close()
+            if stream:
+                stream.flush()
+                os.fsync(stream.fileno())
+                stream.close()
         
         eval_end_time = time.time()
 
+        n_total = tally.n_total
+        if n_total < n:
+            print(f"Warning: Ran out of samples. Only processed {n_total}/{n}")
+
         # Results - now guaranteed n_total == n (or we ran out of samples)
         if n_total > 0:
-            lsp_accuracy = n_correct_lsp / n_total
-            scalpel_accuracy = n_correct_scalpel / n_total
+            lsp_accuracy = tally.n_correct_lsp / n_total
+            scalpel_accuracy = tally.n_correct_scalpel / n_total
             improvement = scalpel_accuracy - lsp_accuracy
-            avg_latency_ms = total_latency_ms / n_total
+            avg_latency_ms = tally.total_latency_ms / tally.n_timed if tally.n_timed else 0.0
         else:
             lsp_accuracy = 0.0
             scalpel_accuracy = 0.0
@@ -155,26 +395,50 @@ class CompletionEvaluator:
         print(f"Scalpel (th=0.0):    {scalpel_accuracy:.1%} accuracy")
         print(f"Improvement:         {improvement:+.1%}")
         print(f"Avg Latency:         {avg_latency_ms:.1f}ms per prediction")
+        if self.cache:
+            print(f"Completion Cache:    {tally.cache_hits} hits | {n_total - tally.cache_hits} misses (hits excluded from latency)")
+        if tally.server_cache_hits:
+            print(f"⚠️  Server response cache answered {tally.server_cache_hits} requests; their latencies are not model latencies")
+
+        latency_summary = tally.latency.summary()
+        client = latency_summary['client_ms']
+        if client['count']:
+            print(f"Client Latency:      p50 {client['p50']:.1f}ms | p90 {client['p90']:.1f}ms | "
+                  f"p99 {client['p99']:.1f}ms | max {client['max']:.1f}ms")
+        overhead = latency_summary['overhead_ms']
+        if overhead['count']:
+            print(f"Network/Queue:       p50 {overhead['p50']:.1f}ms | p99 {overhead['p99']:.1f}ms")
+        for stage, stats in latency_summary['stages'].items():
+            print(f"  {stage:<18} p50 {stats['p50']:.1f}ms | p99 {stats['p99']:.1f}ms")
         print(f"{'='*60}\n")
 
         results = {
             'timestamp': datetime.now().isoformat(),
             'model_path': self.model.model_path,
             'n_samples': n_total,
+            'n_resumed': n_resumed,
             'experiment_duration_seconds': eval_end_time - eval_start_time,
             'lsp_accuracy': lsp_accuracy,
             'scalpel_accuracy': scalpel_accuracy,
             'improvement': improvement,
+            'n_scalpel_used': tally.n_scalpel_used,
             'avg_latency_ms': avg_latency_ms, 
+            'latency': latency_summary,
+            'cache': {
+                'enabled': self.cache is not None,
+                'hits': tally.cache_hits,
+                'misses': n_total - tally.cache_hits,
+                'server_hits': tally.server_cache_hits,
+            },
             'context_window': self.context_window,
         }
 
-        if save_results:
-            save_dir = self._save_results(results, detailed_samples=detailed_samples)
-            results['save_dir'] = save_dir
+        if save_dir:
+            self._save_results(save_dir, results)
+            results['save_dir'] = str(save_dir)
             print(f"\n✓ Results saved to: {save_dir}")
             print(f"  - results.json: Summary statistics")
-            print(f"  - samples.jsonl: LLM completions only ({len(detailed_samples)} samples)")
+            print(f"  - samples.jsonl: Per-sample results ({n_total} samples, 'used_llm' marks LLM completions)")
 
         return results
 
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for llama-server, for benchmarking without a model.
+
+Implements /health, /tokenize, /detokenize and /completion with configurable
+tokenization speed, per-token generation latency and failure injection, so
+the Rust server's own overhead, concurrency and truncation logic can be
+profiled on any machine. Each --parallel slot remembers its last prompt, so
+cache_prompt/id_slot reuse shows up in timings.prompt_n and timings.cache_n.
+With "stream": true, /completion answers with server-sent events, one per
+generated token, like llama-server.
+
+It accepts the same command line as llama-server (unknown flags are
+ignored), so the Rust server can launch it directly:
+
+    SCALPEL_LLAMA_BINARY=$PWD/fake_llama_server.py \\
+    SCALPEL_MODEL_PATH=qwen-fake.gguf \\
+    FAKE_LLAMA_MS_PER_TOKEN=15 \\
+    cargo run --release
+
+Every knob can be given as a flag or as a FAKE_LLAMA_* environment variable
+(flags win); environment variables pass through the Rust server untouched.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import select
+import socket
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Word, whitespace run, or single punctuation character
+TOKEN_RE = re.compile(r"\w+|\s+|[^\w\s]")
+
+FIM_SUFFIX = "<|fim_suffix|>"
+SPECIAL_TOKEN_RE = re.compile(r"<\|[^|]*\|>")
+IDENTIFIER_RE = re.compile(r"[A-Za-z_]\w*")
+
+
+class Vocab:
+    """Grows on demand so detokenize(tokenize(text)) == text exactly."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._pieces = []
+
+    def encode(self, text):
+        with self._lock:
+            tokens = []
+            for piece in TOKEN_RE.findall(text):
+                tok_id = self._ids.get(piece)
+                if tok_id is None:
+                    tok_id = len(self._pieces)
+                    self._ids[piece] = tok_id
+                    self._pieces.append(piece)
+                tokens.append(tok_id)
+            return tokens
+
+    def pieces(self, tokens):
+        with self._lock:
+            return [self._pieces[t] for t in tokens if 0 <= t < len(self._pieces)]
+
+    def decode(self, tokens):
+        return "".join(self.pieces(tokens))
+
+
+class Slot:
+    """One generation slot and the prompt tokens left in its KV cache."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = []
+
+
+class SlotPool:
+    def __init__(self, n):
+        self.slots = [Slot() for _ in range(max(1, n))]
+
+    def acquire(self, id_slot):
+        """Lock the requested slot, or any free one when id_slot is -1."""
+        if 0 <= id_slot < len(self.slots):
+            slot = self.slots[id_slot]
+        else:
+            slot = next((s for s in self.slots if s.lock.acquire(blocking=False)), None)
+            if slot is not None:
+                return slot
+            slot = self.slots[0]
+        slot.lock.acquire()
+        return slot
+
+
+def common_prefix_len(a, b):
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+def env_default(name, default, cast):
+    value = os.environ.get(f"FAKE_LLAMA_{name}")
+    return cast(value) if value is not None else default
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Fake llama-server")
+    # Flags the Rust server passes to llama-server
+    parser.add_argument("-m", "--model", type=str, default="fake.gguf")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--ctx-size", type=int, default=2048)
+    parser.add_argument("--parallel", type=int, default=env_default("PARALLEL", 1, int),
+                        help="Concurrent generation slots")
+    # Simulation knobs
+    parser.add_argument("--tokenize-us-per-char", type=float, default=env_default("TOKENIZE_US_PER_CHAR", 0.05, float),
+                        help="Tokenize/detokenize cost in microseconds per character")
+    parser.add_argument("--prompt-ms-per-token", type=float, default=env_default("PROMPT_MS_PER_TOKEN", 0.2, float),
+                        help="Prefill cost per prompt token")
+    parser.add_argument("--ms-per-token", type=float, default=env_default("MS_PER_TOKEN", 15.0, float),
+                        help="Generation latency per predicted token")
+    parser.add_argument("--failure-rate", type=float, default=env_default("FAILURE_RATE", 0.0, float),
+                        help="Probability that a request fails with HTTP 500")
+    parser.add_argument("--seed", type=int, default=env_default("SEED", 42, int))
+    args, _unknown = parser.parse_known_args(argv)
+    return args
+
+
+def fake_completion(prompt, n_predict):
+    """Deterministic identifier-like completion derived from the prompt."""
+    head = SPECIAL_TOKEN_RE.sub(" ", prompt.split(FIM_SUFFIX, 1)[0])
+    words = IDENTIFIER_RE.findall(head[-2000:])
+    if not words:
+        return "x", 1
+    digest = int(hashlib.sha1(prompt.encode("utf-8")).hexdigest(), 16)
+    word = words[digest % len(words)]
+    # Roughly one token per 4 characters, capped by n_predict
+    n_tokens = max(1, min(n_predict, (len(word) + 3) // 4))
+    return word, n_tokens
+
+
+def make_handler(args, vocab, slots, rng):
+    rng_lock = threading.Lock()
+
+    def should_fail():
+        with rng_lock:
+            return rng.random() < args.failure_rate
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *_):
+            pass
+
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _client_gone(self):
+            """True once the client closed the connection (readable with no data)."""
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            if not readable:
+                return False
+            try:
+                return self.connection.recv(1, socket.MSG_PEEK) == b""
+            except OSError:
+                return True
+
+        def _generate(self, seconds):
+            """Sleep like a generation; stop early if the client disconnects, as llama-server does."""
+            deadline = time.perf_counter() + seconds
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return True
+                if self._client_gone():
+                    return False
+                time.sleep(min(remaining, 0.005))
+
+        def _send_event(self, payload):
+            self.wfile.write(b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n")
+            self.wfile.flush()
+
+        def _read_json(self):
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, {"status": "ok"})
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            try:
+                body = self._read_json()
+            except ValueError:
+                self._send(400, {"error": "invalid JSON"})
+                return
+
+            if should_fail():
+                self._send(500, {"error": "injected failure"})
+                return
+
+            if self.path == "/tokenize":
+                content = body.get("content", "")
+                time.sleep(len(content) * args.tokenize_us_per_char / 1e6)
+                tokens = vocab.encode(content)
+                if body.get("with_pieces"):
+                    pieces = vocab.pieces(tokens)
+                    tokens = [{"id": t, "piece": p} for t, p in zip(tokens, pieces)]
+                self._send(200, {"tokens": tokens})
+            elif self.path == "/detokenize":
+                content = vocab.decode(body.get("tokens", []))
+                time.sleep(len(content) * args.tokenize_us_per_char / 1e6)
+                self._send(200, {"content": content})
+            elif self.path == "/completion":
+                self._complete(body)
+            else:
+                self._send(404, {"error": "not found"})
+
+        def _complete(self, body):
+            prompt = body.get("prompt", "")
+            n_predict = int(body.get("n_predict", 16))
+            prompt_tokens = vocab.encode(prompt)
+            prompt_n = len(prompt_tokens)
+            # Like llama-server, --ctx-size is split between the slots
+            slot_ctx = args.ctx_size // max(1, args.parallel)
+            if prompt_n + n_predict > slot_ctx:
+                self._send(400, {"error": f"prompt ({prompt_n} tokens) exceeds context size ({slot_ctx})"})
+                return
+
+            # Requests beyond --parallel wait for a free slot, like llama-server
+            slot = slots.acquire(int(body.get("id_slot", -1)))
+            try:
+                # Only the part of the prompt not already in the slot's KV cache is evaluated
+                cached = common_prefix_len(slot.tokens, prompt_tokens) if body.get("cache_prompt", True) else 0
+                cached = max(0, min(cached, prompt_n - 1))  # The last prompt token is always re-evaluated
+                evaluated = prompt_n - cached
+                prompt_ms = evaluated * args.prompt_ms_per_token
+                content, predicted_n = fake_completion(prompt, n_predict)
+                predicted_ms = predicted_n * args.ms_per_token
+                if body.get("stream"):
+                    finished = self._stream(content, predicted_n, prompt_ms)
+                else:
+                    finished = self._generate((prompt_ms + predicted_ms) / 1000)
+                if not finished:
+                    # Cancelled mid-generation: keep whatever part of the cache survived
+                    slot.tokens = slot.tokens[:cached]
+                    self.close_connection = True
+                    return
+                slot.tokens = prompt_tokens
+            finally:
+                slot.lock.release()
+
+            result = {
+                "content": "" if body.get("stream") else content,
+                "prompt": prompt,
+                "stop": True,
+                "tokens_evaluated": prompt_n,
+                "tokens_predicted": predicted_n,
+                # Like llama-server: the slot's n_past, prompt plus generated tokens
+                "tokens_cached": prompt_n + predicted_n,
+                "timings": {
+                    "cache_n": cached,
+                    "prompt_n": evaluated,
+                    "prompt_ms": prompt_ms,
+                    "predicted_n": predicted_n,
+                    "predicted_ms": predicted_ms,
+                },
+            }
+            if body.get("stream"):
+                try:
+                    self._send_event(result)
+                except OSError:
+                    pass
+            else:
+                self._send(200, result)
+
+        def _stream(self, content, predicted_n, prompt_ms):
+            """Send `content` as predicted_n token events; False if the client went away."""
+            if not self._generate(prompt_ms / 1000):
+                return False
+            # No Content-Length: the stream ends when the connection closes
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            size = -(-len(content) // predicted_n)
+            try:
+                for i in range(predicted_n):
+                    if not self._generate(args.ms_per_token / 1000):
+                        return False
+                    self._send_event({"content": content[i * size:(i + 1) * size], "stop": False})
+            except OSError:
+                return False
+            return True
+
+    return Handler
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    vocab = Vocab()
+    slots = SlotPool(args.parallel)
+    handler = make_handler(args, vocab, slots, random.Random(args.seed))
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), handler)
+    server.daemon_threads = True
+    print(f"fake llama-server on http://127.0.0.1:{args.port} (ctx {args.ctx_size}, "
+          f"{args.ms_per_token}ms/token, failure rate {args.failure_rate})", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,98 @@
 import os
 import subprocess
 import json
-from typing import List, Optional
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import List, Optional, Tuple
 import time
 import tempfile
+import shutil
+
+# LSP TextDocumentSyncKind.Incremental
+TEXT_DOCUMENT_SYNC_INCREMENTAL = 2
+
+# Completion requests outstanding at once in request_completions
+MAX_IN_FLIGHT = 64
+
+# Recent server notifications kept for debugging; older ones are dropped
+MAX_NOTIFICATIONS = 256
+
+SCRATCH_EXTENSIONS = {
+    "python": ".py",
+    "java": ".java",
+}
+
+
+def _utf16_len(text: str) -> int:
+    """LSP positions count UTF-16 code units."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _position(text: str, offset: int) -> dict:
+    """Convert a character offset in `text` to an LSP position."""
+    line = text.count("\n", 0, offset)
+    line_start = text.rfind("\n", 0, offset) + 1
+    return {"line": line, "character": _utf16_len(text[line_start:offset])}
+
+
+def _incremental_change(old: str, new: str) -> dict:
+    """Smallest single-range edit that turns `old` into `new`."""
+    limit = min(len(old), len(new))
+    start = 0
+    while start < limit and old[start] == new[start]:
+        start += 1
+    end = 0
+    while end < limit - start and old[len(old) - 1 - end] == new[len(new) - 1 - end]:
+        end += 1
+
+    return {
+        "range": {
+            "start": _position(old, start),
+            "end": _position(old, len(old) - end),
+        },
+        "text": new[start:len(new) - end],
+    }
+
 
 class LSPClient:
-    def __init__(self, cmd: List[str], root_uri: str = None):
+    def __init__(self, cmd: List[str], root_uri: str = None, max_open_documents: int = 32):
         """Start LSP server with given command (e.g., ['pylsp'])"""
+        # Binary pipes: Content-Length counts bytes, not characters
         self.process = subprocess.Popen(
             cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, 
-            stderr=subprocess.DEVNULL, text=True, bufsize=0
+            stderr=subprocess.DEVNULL, bufsize=0
         )
         self.req_id = 0
-        self.document_versions = {}
+        # Open documents in LRU order; the oldest is closed past the limit
+        self.document_versions = OrderedDict()
+        self.max_open_documents = max_open_documents
         self.root_uri = root_uri
-        time.sleep(0.1)  # Give server time to start
+
+        # Responses are routed to futures by request id; notifications are
+        # kept separately so they are never mistaken for (or eat) responses
+        self._pending = {}
+        self._lock = threading.Lock()
+        # Writes can block on a full stdin pipe, so they take their own lock;
+        # the reader only ever needs _lock and can always keep draining stdout
+        self._write_lock = threading.Lock()
+        # Nothing consumes these, so only the most recent are kept: chatty
+        # servers (e.g. jdtls $/progress) would otherwise grow it without bound
+        self.notifications = deque(maxlen=MAX_NOTIFICATIONS)
+
+        # Latest publishDiagnostics per URI: uri -> (sequence, version, diagnostics).
+        # Waiters are woken through the condition instead of polling.
+        self._diagnostics = {}
+        self._diagnostics_seq = 0
+        self._diagnostics_cond = threading.Condition()
+
+        # Scratch documents used by the validation engine, per language
+        self._scratch_docs = {}
+        self._scratch_dir = tempfile.mkdtemp(prefix="scalpel_scratch_")
+        self.server_capabilities = {}
+        self._reader = threading.Thread(target=self._reader_loop, daemon=True)
+        self._reader.start()
+
         self._init_lsp()
         
     def _init_lsp(self):
@@ -33,126 +110,254 @@ class LSPClient:
             params["rootUri"] = f"file://{self.root_uri}"
             params["rootPath"] = self.root_uri
             
-        response = self._send_request("initialize", params)
+        response = self._send_request("initialize", params, timeout=30)
         
         if response:
+            self.server_capabilities = (response.get("result") or {}).get("capabilities", {})
             self._send_notification("initialized", {})
     
     def _read_message(self) -> Optional[dict]:
-        """Read one LSP message"""
-        try:
-            # Read headers
-            content_length = 0
-            while True:
-                line = self.process.stdout.readline()
-                if not line:
-                    return None
-                if line.startswith("Content-Length:"):
-                    content_length = int(line.split(":")[1].strip())
-                elif line.strip() == "":
-                    break  # End of headers
-            
-            if content_length == 0:
+        """Read one framed LSP message (blocking, byte-exact)"""
+        stdout = self.process.stdout
+        content_length = 0
+        while True:
+            line = stdout.readline()
+            if not line:
                 return None
-                
-            # Read content
-            content = self.process.stdout.read(content_length)
-            return json.loads(content)
-        except:
-            return None
+            if line.lower().startswith(b"content-length:"):
+                content_length = int(line.split(b":")[1].strip())
+            elif line.strip() == b"":
+                break  # End of headers
+        
+        # Pipes may return short reads, so keep reading until complete
+        chunks = []
+        remaining = content_length
+        while remaining > 0:
+            chunk = stdout.read(remaining)
+            if not chunk:
+                return None
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return json.loads(b"".join(chunks))
+
+    def _reader_loop(self):
+        """Dispatch incoming messages until the server closes stdout."""
+        while True:
+            try:
+                message = self._read_message()
+            except (ValueError, OSError):
+                message = None
+            if message is None:
+                break
+
+            if "method" not in message:
+                # Response to one of our requests
+                with self._lock:
+                    future = self._pending.pop(message.get("id"), None)
+                if future is not None:
+                    future.set_result(message)
+            elif "id" in message:
+                # Server -> client request (e.g. workspace/configuration);
+                # answer with null so the server does not block on us. The
+                # reply is written from another thread so a writer stuck on
+                # a full stdin pipe cannot stop this loop draining stdout.
+                reply = {"jsonrpc": "2.0", "id": message["id"], "result": None}
+                threading.Thread(target=self._write, args=(reply,), daemon=True).start()
+            elif message["method"] == "textDocument/publishDiagnostics":
+                params = message.get("params", {})
+                with self._diagnostics_cond:
+                    self._diagnostics_seq += 1
+                    self._diagnostics[params.get("uri")] = (
+                        self._diagnostics_seq,
+                        params.get("version"),
+                        params.get("diagnostics", []),
+                    )
+                    self._diagnostics_cond.notify_all()
+            else:
+                self.notifications.append(message)
+
+        # Server went away: release anyone still waiting
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_result(None)
+
+    def _write(self, payload: dict):
+        """Frame and write one message"""
+        body = json.dumps(payload).encode("utf-8")
+        data = f"Content-Length: {len(body)}\r\n\r\n".encode("ascii") + body
+        with self._write_lock:
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
     
     def _send_notification(self, method: str, params: dict):
         """Send notification (no response expected)"""
-        msg = json.dumps({
+        self._write({
             "jsonrpc": "2.0", 
             "method": method, 
             "params": params
         })
-        full_msg = f"Content-Length: {len(msg)}\r\n\r\n{msg}"
-        self.process.stdin.write(full_msg)
-        self.process.stdin.flush()
-    
-    def _send_request(self, method: str, params: dict) -> Optional[dict]:
-        """Send request and wait for response"""
-        self.req_id += 1
-        request_id = self.req_id
+
+    def _send_request_async(self, method: str, params: dict) -> Future:
+        """Send request without waiting; the future resolves to the response"""
+        future = Future()
+        with self._lock:
+            self.req_id += 1
+            request_id = self.req_id
+            self._pending[request_id] = future
+        future.request_id = request_id
         
-        msg = json.dumps({
+        self._write({
             "jsonrpc": "2.0", 
             "id": request_id, 
             "method": method, 
             "params": params
         })
-        
-        full_msg = f"Content-Length: {len(msg)}\r\n\r\n{msg}"
-        self.process.stdin.write(full_msg)
-        self.process.stdin.flush()
-        
-        # Read messages until we get our response
-        for _ in range(10):  # Max 10 attempts
-            message = self._read_message()
-            if message and message.get("id") == request_id:
-                return message
-            time.sleep(0.01)  # Small delay
-        
-        return None
+        return future
     
-    def _collect_diagnostics(self, uri: str, timeout: float = 1.0) -> list:
-        """Collect diagnostics for a given file URI (from publishDiagnostics)."""
-        diagnostics = []
-        start = time.time()
-
-        while time.time() - start < timeout:
-            msg = self._read_message()
-            if not msg:
-                continue
+    def _send_request(self, method: str, params: dict, timeout: float = 10.0) -> Optional[dict]:
+        """Send request and wait for response"""
+        future = self._send_request_async(method, params)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            self._cancel(future)
+            return None
+
+    def _cancel(self, future: Future):
+        """Stop waiting for a request: forget its future and ask the server to drop it."""
+        with self._lock:
+            self._pending.pop(future.request_id, None)
+        self._send_notification("$/cancelRequest", {"id": future.request_id})
+    
+    def _diagnostics_mark(self) -> int:
+        """Sequence number to pass to _collect_diagnostics as `after`."""
+        with self._diagnostics_cond:
+            return self._diagnostics_seq
+
+    def _collect_diagnostics(self, uri: str, timeout: float = 1.0, after: int = 0, version: int = None) -> list:
+        """
+        Wait for diagnostics for a given file URI (from publishDiagnostics).
 
-            # Only care about publishDiagnostics notifications
-            if msg.get("method") == "textDocument/publishDiagnostics":
-                params = msg.get("params", {})
-                if params.get("uri") == uri:
-                    diagnostics.extend(params.get("diagnostics", []))
-                    # Most LSPs send one diagnostics batch per change — can break early
-                    break
+        Only batches received after sequence number `after` count, and if the
+        server reports document versions, only those for `version` or later.
+        """
+        deadline = time.time() + timeout
 
-            # Give other messages a chance to arrive
-            time.sleep(0.01)
+        def ready():
+            entry = self._diagnostics.get(uri)
+            if entry is None or entry[0] <= after:
+                return False
+            return version is None or entry[1] is None or entry[1] >= version
 
-        return diagnostics
+        with self._diagnostics_cond:
+            while not ready():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return []
+                self._diagnostics_cond.wait(remaining)
+            return list(self._diagnostics[uri][2])
     
-    def open_file(self, file_path: str, languageId: str = "python") -> str:
+    def open_file(self, file_path: str, languageId: str = "python", ready_timeout: float = 5.0) -> str:
         """Open a file in the LSP server and return its URI."""
+        uri = f"file://{os.path.abspath(file_path)}"
+
+        if uri in self.document_versions:
+            self.document_versions.move_to_end(uri)
+            return uri
+
         with open(file_path) as f:
             full_content = f.read()
         
-            uri = f"file://{os.path.abspath(file_path)}"
-        
-            if uri not in self.document_versions:
-                self.document_versions[uri] = 1
-                self._send_notification("textDocument/didOpen", {
-                    "textDocument": {
-                        "uri": uri,
-                        "languageId": languageId,
-                        "version": 1,
-                        "text": full_content
-                    }
-                })
+        self.document_versions[uri] = 1
+        self._send_notification("textDocument/didOpen", {
+            "textDocument": {
+                "uri": uri,
+                "languageId": languageId,
+                "version": 1,
+                "text": full_content
+            }
+        })
+
+        # Close least recently used documents so server memory stays bounded
+        while len(self.document_versions) > self.max_open_documents:
+            old_uri, _ = self.document_versions.popitem(last=False)
+            self._send_notification("textDocument/didClose", {
+                "textDocument": {"uri": old_uri}
+            })
         
-        # Give server a moment to process the file
-        time.sleep(0.05)
+        self._wait_until_ready(uri, ready_timeout)
         return uri
 
-    def request_completion(self, uri: str, line: int, col: int) -> list:
-        """Request completions at a specific position without re-opening file."""
-        response = self._send_request("textDocument/completion", {
+    def _wait_until_ready(self, uri: str, timeout: float):
+        """
+        Block until the server has processed everything sent for `uri`.
+
+        Servers handle messages in order, so any response to a cheap probe
+        request (even an error) means the didOpen before it was processed.
+        """
+        self._send_request("textDocument/foldingRange", {
+            "textDocument": {"uri": uri}
+        }, timeout=timeout)
+
+    def request_completion_async(self, uri: str, line: int, col: int) -> Future:
+        """Send a completion request without waiting for the response."""
+        return self._send_request_async("textDocument/completion", {
             "textDocument": {"uri": uri},
             "position": {"line": line, "character": col}
         })
-    
-        if not response or "result" not in response:
+
+    def request_completion(self, uri: str, line: int, col: int) -> list:
+        """Request completions at a specific position without re-opening file."""
+        future = self.request_completion_async(uri, line, col)
+        try:
+            return self._completion_texts(future.result(timeout=10.0))
+        except FutureTimeoutError:
+            self._cancel(future)
+            return []
+
+    def request_completions(self, uri: str, positions: List[Tuple[int, int]], timeout: float = 30.0,
+                            max_in_flight: int = MAX_IN_FLIGHT) -> List[Optional[list]]:
+        """
+        Pipeline completion requests for many (line, col) positions.
+
+        Up to `max_in_flight` requests are outstanding at once, so the server
+        rather than the round trip sets the pace without the pipes filling up.
+
+        Returns:
+            Completion texts per position, or None where no response arrived
+            before the deadline (requests not yet sent by then are skipped)
+        """
+        deadline = time.time() + timeout
+        results = [None] * len(positions)
+        in_flight = deque()
+        next_index = 0
+        while next_index < len(positions) or in_flight:
+            while next_index < len(positions) and len(in_flight) < max_in_flight and time.time() < deadline:
+                line, col = positions[next_index]
+                in_flight.append((next_index, self.request_completion_async(uri, line, col)))
+                next_index += 1
+            if not in_flight:
+                break
+
+            index, future = in_flight.popleft()
+            try:
+                response = future.result(timeout=max(0.0, deadline - time.time()))
+            except FutureTimeoutError:
+                self._cancel(future)
+                continue
+            results[index] = self._completion_texts(response)
+        return results
+
+    @staticmethod
+    def _completion_texts(response: Optional[dict]) -> list:
+        """Extract completion strings from a textDocument/completion response."""
+        if not response or not response.get("result"):
             return []
         
-        items = response.get("result", {}).get("items", [])
+        result = response["result"]
+        # Result is either CompletionItem[] or a CompletionList
+        items = result if isinstance(result, list) else result.get("items", [])
         
         completions = []
         for item in items:
@@ -187,79 +392,126 @@ class LSPClient:
         
         return completions
     
-    def validate_code(self, code: str) -> bool:        
-        
-        # Create temp file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-            f.write(code)
-            uri = f"file://{f.name}"
-        
-        try:
-            # Open document in LSP
+    def _scratch_pool(self, language_id: str, size: int) -> list:
+        """Open (once) `size` scratch documents used for validating snippets."""
+        docs = self._scratch_docs.setdefault(language_id, [])
+        extension = SCRATCH_EXTENSIONS.get(language_id, ".txt")
+        n_existing = len(docs)
+        mark = self._diagnostics_mark()
+        while len(docs) < size:
+            path = os.path.join(self._scratch_dir, f"scratch_{len(docs)}{extension}")
+            doc = {"uri": f"file://{path}", "version": 1, "text": ""}
             self._send_notification("textDocument/didOpen", {
                 "textDocument": {
-                    "uri": uri,
-                    "languageId": "python",
+                    "uri": doc["uri"],
+                    "languageId": language_id,
                     "version": 1,
-                    "text": code
+                    "text": ""
                 }
             })
+            docs.append(doc)
+
+        # Drain the diagnostics published for didOpen so they cannot be
+        # mistaken for the verdict on the first edit
+        for doc in docs[n_existing:]:
+            self._collect_diagnostics(doc["uri"], after=mark)
+        return docs[:size]
+
+    def _change_scratch(self, doc: dict, text: str):
+        """Replace a scratch document's text with a single didChange edit."""
+        doc["version"] += 1
+        sync = self.server_capabilities.get("textDocumentSync")
+        if isinstance(sync, dict):
+            sync = sync.get("change")
+
+        if sync == TEXT_DOCUMENT_SYNC_INCREMENTAL:
+            change = _incremental_change(doc["text"], text)
+        else:
+            change = {"text": text}
+
+        doc["text"] = text
+        self._send_notification("textDocument/didChange", {
+            "textDocument": {"uri": doc["uri"], "version": doc["version"]},
+            "contentChanges": [change]
+        })
+
+    @staticmethod
+    def _is_valid(diagnostics: list) -> bool:
+        """A snippet is valid unless diagnostics report a semantic problem."""
+        for d in diagnostics:
+            msg = d.get("message", "").lower()
             
-            # Collect diagnostics
-            diagnostics = self._collect_diagnostics(uri)
-            
-            # Close document
-            self._send_notification("textDocument/didClose", {
-                "textDocument": {"uri": uri}
-            })
-            
-            # Analyze diagnostics
-            semantic_errors = []
-            for d in diagnostics:
-                msg = d.get("message", "").lower()
-                
-                # Ignore incomplete syntax or formatting issues
-                if any(s in msg for s in [
-                    "unexpected eof",
-                    "was never closed",
-                    "expected",
-                    "newline at end",
-                    "indentation",
-                ]):
-                    continue
-                
-                # Flag semantic problems
-                if any(s in msg for s in [
-                    "undefined name",
-                    "attributeerror",
-                    "keyerror",
-                    "name is not defined",
-                    "object has no attribute",
-                    "not callable",
-                    "cannot import",
-                ]):
-                    semantic_errors.append({
-                        'message': d.get('message'),
-                        'severity': d.get('severity'),
-                        'range': d.get('range')
-                    })
-            
+            # Ignore incomplete syntax or formatting issues
+            if any(s in msg for s in [
+                "unexpected eof",
+                "was never closed",
+                "expected",
+                "newline at end",
+                "indentation",
+            ]):
+                continue
             
-            # Determine if valid
-            is_valid = len(semantic_errors) == 0  
+            # Flag semantic problems
+            if any(s in msg for s in [
+                "undefined name",
+                "attributeerror",
+                "keyerror",
+                "name is not defined",
+                "object has no attribute",
+                "not callable",
+                "cannot import",
+            ]):
+                return False
 
-            return is_valid
-            
-        finally:
-            os.unlink(f.name)
+        return True
+
+    def validate_batch(self, codes: List[str], language_id: str = "python",
+                       scratch_documents: int = 8, timeout: float = 2.0) -> List[bool]:
+        """
+        Validate many code snippets against a pool of scratch documents.
+
+        Each round edits every scratch document with didChange and then waits
+        for their diagnostics together, so documents lint concurrently.
+
+        Returns:
+            One verdict per snippet, in input order
+        """
+        docs = self._scratch_pool(language_id, max(1, min(scratch_documents, len(codes))))
+        verdicts = []
+
+        for round_start in range(0, len(codes), len(docs)):
+            round_codes = codes[round_start:round_start + len(docs)]
+            mark = self._diagnostics_mark()
+            for doc, code in zip(docs, round_codes):
+                self._change_scratch(doc, code)
+
+            for doc in docs[:len(round_codes)]:
+                diagnostics = self._collect_diagnostics(
+                    doc["uri"], timeout=timeout, after=mark, version=doc["version"]
+                )
+                verdicts.append(self._is_valid(diagnostics))
+
+        return verdicts
+
+    def validate_completions(self, code_before: str, candidates: List[str], code_after: str,
+                             language_id: str = "python") -> List[bool]:
+        """Validate candidate completions inserted between code_before and code_after."""
+        return self.validate_batch(
+            [code_before + candidate + code_after for candidate in candidates],
+            language_id=language_id,
+        )
+
+    def validate_code(self, code: str, language_id: str = "python") -> bool:
+        return self.validate_batch([code], language_id=language_id, scratch_documents=1)[0]
     
     def close(self):
         """Cleanup"""
         try:
-            self._send_request("shutdown", {})
+            self._send_request("shutdown", {}, timeout=2.0)
             self._send_notification("exit", {})
         except:
             pass
         
         self.process.terminate()
+        shutil.rmtree(self._scratch_dir, ignore_errors=True)
    
\ No newline at end of file
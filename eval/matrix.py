@@ -0,0 +1,243 @@
+"""
+Parallel configuration-matrix benchmark orchestrator.
+
+Evaluates every combination of models x context windows x threads x
+max_predict. Configurations run side by side, each with its own Rust
+server / llama-server port pair and its own pinned CPU cores, so they do
+not steal compute from each other. The results are consolidated into one
+accuracy-vs-latency report with the Pareto-optimal configurations marked.
+
+Samples must already exist (run eval.py once to generate them).
+
+Usage:
+    python matrix.py --models ../models/a.gguf,../models/b.gguf \\
+        --contexts 512,1024,2048 --threads 4 --max-predict 10 --n-samples 500
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import itertools
+import subprocess
+from datetime import datetime
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from server_client import ScalpelServerClient
+from sample_generator import SampleGenerator
+from evaluator import CompletionEvaluator
+
+BASE_PORT = 3100
+SERVER_START_TIMEOUT_S = 120
+
+
+def config_name(config):
+    model_short = Path(config['model']).stem[:20]
+    return f"{model_short}_ctx{config['context']}_t{config['threads']}_p{config['max_predict']}"
+
+
+def start_config_server(args, config, ports, cores, log_file):
+    """Launch the Rust server (which launches llama-server) pinned to `cores`."""
+    env = os.environ.copy()
+    env["SCALPEL_MODEL_PATH"] = os.path.abspath(config['model'])
+    env["SCALPEL_PORT"] = str(ports[0])
+    env["SCALPEL_LLAMA_PORT"] = str(ports[1])
+    env["SCALPEL_MAX_CONTEXT"] = str(config['context'])
+    env["SCALPEL_MAX_PREDICT"] = str(config['max_predict'])
+    env["SCALPEL_THREADS"] = str(config['threads'])
+    env["SCALPEL_GPU_LAYERS"] = args.gpu_layers
+
+    def pin():
+        # Inherited by llama-server, which the Rust server spawns
+        os.sched_setaffinity(0, cores)
+
+    return subprocess.Popen(
+        [args.server_binary],
+        env=env,
+        stdout=log_file,
+        stderr=subprocess.STDOUT,
+        preexec_fn=pin,
+        start_new_session=True,  # Own process group, so cleanup reaches llama-server too
+    )
+
+
+def stop_config_server(process):
+    """Ctrl-C lets the Rust server kill llama-server; SIGKILL the group if it hangs."""
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            pass
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def run_config(args, config, ports, cores, run_dir):
+    """Evaluate one configuration in a worker process; returns its report row."""
+    name = config_name(config)
+    log_path = Path(run_dir) / f"{name}.log"
+    row = {'name': name, **config, 'ports': list(ports), 'cores': sorted(cores), 'log': str(log_path)}
+
+    with open(log_path, 'w') as log_file:
+        # Keep per-sample evaluator output out of the orchestrator's console
+        sys.stdout = log_file
+
+        server = start_config_server(args, config, ports, cores, log_file)
+        try:
+            client = ScalpelServerClient(server_url=f"http://localhost:{ports[0]}", model_path=config['model'])
+            deadline = time.time() + SERVER_START_TIMEOUT_S
+            while not client.ping():
+                if server.poll() is not None or time.time() > deadline:
+                    row['error'] = "server failed to start"
+                    return row
+                time.sleep(1)
+
+            generator = SampleGenerator(basedir=args.basedir, samples_file=args.samples_file)
+            samples = generator.load_samples()
+            evaluator = CompletionEvaluator(
+                model=client,
+                lsp=None,
+                basedir=args.basedir,
+                context_window=str(config['context']),
+            )
+            # Configurations can start in the same second, so each gets its
+            # own directory rather than a timestamped one under results/
+            results = evaluator.evaluate_vs_baseline(
+                samples=samples, n=args.n_samples, save_dir=str(Path(run_dir) / name)
+            )
+        finally:
+            stop_config_server(server)
+            sys.stdout.flush()
+            sys.stdout = sys.__stdout__
+
+    client_latency = results['latency']['client_ms']
+    row.update({
+        'n_samples': results['n_samples'],
+        'scalpel_accuracy': results['scalpel_accuracy'],
+        'lsp_accuracy': results['lsp_accuracy'],
+        'latency_p50_ms': client_latency.get('p50'),
+        'latency_p99_ms': client_latency.get('p99'),
+        'avg_latency_ms': results['avg_latency_ms'],
+        'duration_seconds': results['experiment_duration_seconds'],
+        'save_dir': results.get('save_dir'),
+    })
+    return row
+
+
+def mark_pareto(rows, latency_key):
+    """Flag rows not dominated on (lower latency, higher accuracy)."""
+    done = [r for r in rows if 'error' not in r]
+    for r in done:
+        r['pareto'] = not any(
+            o is not r
+            and o[latency_key] <= r[latency_key]
+            and o['scalpel_accuracy'] >= r['scalpel_accuracy']
+            and (o[latency_key] < r[latency_key] or o['scalpel_accuracy'] > r['scalpel_accuracy'])
+            for o in done
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an evaluation configuration matrix in parallel")
+    parser.add_argument("--models", type=str, required=True, help="Comma-separated GGUF model paths")
+    parser.add_argument("--contexts", type=str, default="1024", help="Comma-separated context windows")
+    parser.add_argument("--threads", type=str, default="4", help="Comma-separated llama-server thread counts")
+    parser.add_argument("--max-predict", type=str, default="10", help="Comma-separated max_predict values")
+    parser.add_argument("--n-samples", type=int, default=-1, help="Samples per configuration (-1 for all)")
+    parser.add_argument("--basedir", type=str, default="data/py150/token_completion")
+    parser.add_argument("--samples-file", type=str, default="data/py150/samples.json")
+    parser.add_argument("--server-binary", type=str, default="../server/target/release/scalpel",
+                        help="Prebuilt Rust server (cargo build --release)")
+    parser.add_argument("--gpu-layers", type=str, default="-1")
+    parser.add_argument("--latency-metric", type=str, default="latency_p50_ms",
+                        choices=["latency_p50_ms", "latency_p99_ms", "avg_latency_ms"])
+    args = parser.parse_args()
+
+    if not os.path.exists(args.server_binary):
+        raise SystemExit(f"Server binary not found: {args.server_binary} (run cargo build --release)")
+
+    configs = [
+        {'model': model, 'context': int(ctx), 'threads': int(threads), 'max_predict': int(predict)}
+        for model, ctx, threads, predict in itertools.product(
+            args.models.split(","), args.contexts.split(","), args.threads.split(","), args.max_predict.split(",")
+        )
+    ]
+
+    free_cores = sorted(os.sched_getaffinity(0))
+    too_big = [c for c in configs if c['threads'] > len(free_cores)]
+    if too_big:
+        raise SystemExit(f"{len(too_big)} configurations need more than the {len(free_cores)} available cores")
+
+    run_dir = Path("results") / f"matrix_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    run_dir.mkdir(parents=True, exist_ok=True)
+    print(f"🧮 {len(configs)} configurations on {len(free_cores)} cores -> {run_dir}")
+
+    # Each slot owns one port pair; a configuration runs once its cores are free
+    free_slots = list(range(len(free_cores)))
+    pending = list(configs)
+    running = {}
+    submitted = {}
+    rows = []
+
+    with ProcessPoolExecutor(max_workers=len(free_cores)) as executor:
+        while pending or running:
+            while pending and pending[0]['threads'] <= len(free_cores):
+                config = pending.pop(0)
+                cores = set(free_cores[:config['threads']])
+                del free_cores[:config['threads']]
+                slot = free_slots.pop(0)
+                ports = (BASE_PORT + 2 * slot, BASE_PORT + 2 * slot + 1)
+                print(f"  ▶ {config_name(config)} on cores {sorted(cores)}, ports {ports}")
+                future = executor.submit(run_config, args, config, ports, cores, str(run_dir))
+                running[future] = (cores, slot)
+                submitted[future] = config
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                cores, slot = running.pop(future)
+                free_cores = sorted(set(free_cores) | cores)
+                free_slots.append(slot)
+                try:
+                    row = future.result()
+                except Exception as e:
+                    config = submitted[future]
+                    row = {'name': config_name(config), **config, 'error': str(e)}
+                rows.append(row)
+                if 'error' in row:
+                    print(f"  ✗ {row['name']}: {row['error']}")
+                else:
+                    print(f"  ✓ {row['name']}: {row['scalpel_accuracy']:.1%} accuracy, "
+                          f"p50 {row['latency_p50_ms']:.1f}ms")
+
+    mark_pareto(rows, args.latency_metric)
+    rows.sort(key=lambda r: (r.get(args.latency_metric) is None, r.get(args.latency_metric) or 0))
+
+    print(f"\n{'='*78}")
+    print(f"{'configuration':<44} {'accuracy':>9} {'p50 ms':>9} {'p99 ms':>9}  pareto")
+    print(f"{'='*78}")
+    for r in rows:
+        if 'error' in r:
+            print(f"{r['name']:<44} {'failed':>9}")
+            continue
+        print(f"{r['name']:<44} {r['scalpel_accuracy']:>9.1%} {r['latency_p50_ms']:>9.1f} "
+              f"{r['latency_p99_ms']:>9.1f}  {'★' if r['pareto'] else ''}")
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'latency_metric': args.latency_metric,
+        'n_samples': args.n_samples,
+        'configurations': rows,
+    }
+    with open(run_dir / "report.json", 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Report saved to: {run_dir / 'report.json'}")
+
+
+if __name__ == "__main__":
+    main()
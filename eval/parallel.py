@@ -0,0 +1,14 @@
+"""Helpers shared by the process-pool stages of the eval pipeline."""
+
+from collections import deque
+
+
+def ordered_map(executor, fn, iterable, window):
+    """Like executor.map, but keeps at most `window` tasks in flight."""
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
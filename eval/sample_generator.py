@@ -3,6 +3,80 @@ import os
 import json
 import re
 import bisect
+import math
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
+
+from parallel import ordered_map
+
+IDENTIFIER_RE = re.compile(r'^[a-zA-Z_]\w*$')
+
+# Completion requests kept in flight per LSP server
+LSP_PIPELINE_DEPTH = 32
+
+# Candidates queried per sample still needed, on top of the observed hit rate
+CANDIDATE_OVERSAMPLE = 1.5
+
+# Largest backfill batch; files where the LSP rarely answers are worked
+# through in batches of this size instead of one huge one
+MAX_BATCH_SIZE = 4 * LSP_PIPELINE_DEPTH
+
+# LSP client owned by the current shard worker process
+_shard_lsp = None
+
+
+def _init_shard(lsp_cmd, root_uri):
+    """Start this worker's own LSP server; it lives as long as the worker."""
+    global _shard_lsp
+    from lsp_client import LSPClient
+    _shard_lsp = LSPClient(cmd=lsp_cmd, root_uri=root_uri)
+    Finalize(_shard_lsp, _shard_lsp.close, exitpriority=10)
+
+
+def _process_shard_file(task):
+    generator, *args = task
+    return generator._process_file(*args, _shard_lsp)
+
+
+def build_position_index(tokens, code):
+    """
+    Index every position that can become a sample in one file.
+
+    Targets are identifiers and keywords (not the first or last token);
+    each entry carries the trigger (previous) token, its token type, and
+    the 0-based line/col used for the LSP query.
+    """
+    # Pre-compute line offsets for fast position -> line/col conversion
+    line_offsets = [0] + [i + 1 for i, char in enumerate(code) if char == '\n']
+
+    candidates = []
+    for target_idx in range(1, len(tokens) - 1):
+        target_token = tokens[target_idx]['value']
+
+        # Filter targets: Only allow identifiers and keywords
+        # Must start with letter/underscore and contain only word characters
+        # This excludes punctuation like '.', '(', '=', etc.
+        if not IDENTIFIER_RE.match(target_token):
+            continue
+
+        # LSP position is AT the target token start
+        start_pos = tokens[target_idx]['start_pos']
+
+        # Find the line number where line_offsets[line] <= start_pos
+        line_idx = bisect.bisect_right(line_offsets, start_pos) - 1
+
+        candidates.append({
+            'target_token': target_token,
+            'start_pos': start_pos,
+            'trigger_token': tokens[target_idx - 1]['value'],
+            'trigger_type': tokens[target_idx - 1]['type'],
+            'line': line_idx,
+            'col': start_pos - line_offsets[line_idx],
+        })
+
+    return candidates
+
 
 class SampleGenerator:
     """Generates prediction samples from tokenized files with LSP completions."""
@@ -13,14 +87,17 @@ class SampleGenerator:
         self.max_samples_per_file = max_samples_per_file
         self.language_id = language_id
     
-    def generate_samples(self, data_list, lsp_client):
+    def generate_samples(self, data_list, lsp_client, num_shards=1, lsp_cmd=None, root_uri=None):
         """
         Generate samples by checking all positions where LSP has completions.
         Stores top LSP completion in each sample.
         
         Args:
-            data_list: List of dicts with 'file' and 'tokens' keys
+            data_list: TokenStore (or list of dicts with 'file' and 'tokens' keys)
             lsp_client: LSPClient instance for querying completions
+            num_shards: Number of LSP server processes to spread files across
+            lsp_cmd: Command used to start each shard's LSP server (sharded mode)
+            root_uri: Workspace root for each shard's LSP server (sharded mode)
             
         Returns:
             List of samples with pre-computed LSP completions
@@ -29,119 +106,169 @@ class SampleGenerator:
         files_processed = 0
         total_positions_checked = 0
         positions_with_lsp = 0
+        lsp_queries = 0
+        lsp_timeouts = 0
         
-        # Shuffle file list for randomization
-        file_list = list(data_list)
+        # Shuffle file indices for randomization; each file's tokens are
+        # only loaded from the store when it is processed
+        file_list = list(range(len(data_list)))
         random.shuffle(file_list)
+
+        # Per-file selection is seeded from this value and the file index, so
+        # the chosen samples do not depend on how files are spread over shards
+        sample_seed = random.getrandbits(32)
         
         print(f"\n📊 Generating samples from {len(file_list)} files...")
+
+        tasks = (
+            (self, position, len(file_list), file_idx, data_list[file_idx], sample_seed)
+            for position, file_idx in enumerate(file_list, 1)
+        )
+
+        if num_shards > 1:
+            print(f"  Sharding across {num_shards} LSP servers...")
+            executor = ProcessPoolExecutor(
+                max_workers=num_shards,
+                initializer=_init_shard,
+                initargs=(lsp_cmd, root_uri),
+            )
+            results = ordered_map(executor, _process_shard_file, tasks, window=num_shards * 4)
+        else:
+            executor = None
+            results = (self._process_file(*task[1:], lsp_client) for task in tasks)
+
+        try:
+            # Results arrive in shuffled file order regardless of shard count
+            for result in results:
+                if result is None:
+                    continue
+                files_processed += 1
+                total_positions_checked += result['positions_checked']
+                positions_with_lsp += result['positions_with_lsp']
+                lsp_queries += result['lsp_queries']
+                lsp_timeouts += result['lsp_timeouts']
+                samples.extend(result['samples'])
+
+                if files_processed % 10 == 0:
+                    print(f"  Processed {files_processed}/{len(file_list)} files, {len(samples)} samples so far...")
+        finally:
+            if executor is not None:
+                executor.shutdown()
         
-        for file_data in file_list:
-            files_processed += 1
-            file_path = file_data['file']
-            tokens = file_data['tokens']
-            
-            # Read file content
-            full_path = os.path.join(self.basedir, file_path)
-            try:
-                with open(full_path, 'r') as f:
-                    code = f.read()
-            except:
-                print(f"  ⚠️  Could not read {file_path}, skipping...")
-                continue
-            
-            print(f"  [{files_processed}/{len(file_list)}] Processing {file_path} ({len(tokens)} tokens)...")
-            
-            # Open file once in LSP
-            uri = lsp_client.open_file(full_path, languageId=self.language_id)
-            
-            # Pre-compute line offsets for fast position -> line/col conversion
-            line_offsets = [0] + [i + 1 for i, char in enumerate(code) if char == '\n']
-            
-            # Check all positions sequentially (no trigger filtering)
-            file_samples = []
-            for target_idx in range(1, len(tokens) - 1):
-                if target_idx % 500 == 0:
-                    print(f"    Checking token {target_idx}/{len(tokens)} | Found {len(file_samples)} samples...", end='\r')
-                total_positions_checked += 1
-                
-                # Target token
-                target_token = tokens[target_idx]['value']
+        print(f"\n✅ Sample Generation Complete:")
+        print(f"   Files processed: {files_processed}")
+        print(f"   Total positions checked: {total_positions_checked}")
+        print(f"   LSP queries sent: {lsp_queries}")
+        if lsp_timeouts:
+            print(f"   ⚠️  LSP queries timed out (not counted as misses): {lsp_timeouts}")
+        print(f"   Positions with LSP completions: {positions_with_lsp}")
+        print(f"   Final samples: {len(samples)}")
+        print(f"   Avg samples per file: {len(samples)/max(files_processed, 1):.1f}")
+        
+        return samples
 
-                # LSP position is AT the target token start
-                target_start_pos = tokens[target_idx]['start_pos']
-                
-                # Get context before (full prefix)
-                code_before = code[:target_start_pos]
+    def _process_file(self, position, n_files, file_idx, file_data, sample_seed, lsp_client):
+        """Query the LSP at a planned subset of identifiers in one file and select its samples."""
+        file_path = file_data['file']
+        tokens = file_data['tokens']
+        
+        # Read file content
+        full_path = os.path.join(self.basedir, file_path)
+        try:
+            with open(full_path, 'r') as f:
+                code = f.read()
+        except:
+            print(f"  ⚠️  Could not read {file_path}, skipping...")
+            return None
+        
+        print(f"  [{position}/{n_files}] Processing {file_path} ({len(tokens)} tokens)...")
+        
+        # Open file once in LSP
+        uri = lsp_client.open_file(full_path, languageId=self.language_id)
+        
+        positions_checked = max(len(tokens) - 2, 0)
+        positions_with_lsp = 0
+        lsp_queries = 0
+        lsp_timeouts = 0
 
-                # Get context after (full suffix)
-                # MUST skip the target token itself, otherwise the answer is in the suffix!
-                code_after = code[target_start_pos + len(target_token):]
-                
-                # Filter targets: Only allow identifiers and keywords
-                # Must start with letter/underscore and contain only word characters
-                # This excludes punctuation like '.', '(', '=', etc.
-                if not re.match(r'^[a-zA-Z_]\w*$', target_token):
+        candidates = build_position_index(tokens, code)
+        quota = self.max_samples_per_file
+        rng = random.Random(sample_seed + file_idx)
+
+        # Sampling plan: visit candidates in a random order and stop once the
+        # quota is filled. The first K LSP hits of a uniform permutation are a
+        # uniform K-subset of all hits, so the distribution is unchanged while
+        # most positions in large files are never queried.
+        if quota and len(candidates) > quota:
+            plan = rng.sample(candidates, len(candidates))
+            batch_size = min(MAX_BATCH_SIZE, max(LSP_PIPELINE_DEPTH, math.ceil(quota * CANDIDATE_OVERSAMPLE)))
+        else:
+            plan = candidates
+            batch_size = LSP_PIPELINE_DEPTH
+
+        file_samples = []
+        cursor = 0
+        while cursor < len(plan) and not (quota and len(file_samples) >= quota):
+            # Backfill: size the next batch from the hit rate seen so far
+            answered = lsp_queries - lsp_timeouts
+            if quota and answered:
+                hit_rate = max(positions_with_lsp / answered, 1 / answered)
+                missing = quota - len(file_samples)
+                batch_size = min(MAX_BATCH_SIZE, max(LSP_PIPELINE_DEPTH, math.ceil(missing / hit_rate * CANDIDATE_OVERSAMPLE)))
+
+            batch = plan[cursor:cursor + batch_size]
+            cursor += len(batch)
+            lsp_queries += len(batch)
+            print(f"    Queried {lsp_queries}/{len(candidates)} candidates | Found {len(file_samples)} samples...", end='\r')
+
+            # Pipelined: up to LSP_PIPELINE_DEPTH requests are in flight at once
+            batch_completions = lsp_client.request_completions(
+                uri, [(c['line'], c['col']) for c in batch], max_in_flight=LSP_PIPELINE_DEPTH
+            )
+
+            for candidate, lsp_completions in zip(batch, batch_completions):
+                # No answer in time is not the same as no completions
+                if lsp_completions is None:
+                    lsp_timeouts += 1
                     continue
-                
-                # Trigger token (previous token)
-                trigger_token = tokens[target_idx-1]['value'] if target_idx > 0 else ""
-                
-                # Calculate line and col efficiently
-                # Find the line number where line_offsets[line] <= target_start_pos
-                line_idx = bisect.bisect_right(line_offsets, target_start_pos) - 1
-                line_start = line_offsets[line_idx]
-                col_idx = target_start_pos - line_start
-                
-                # Query LSP for completions at this position
-                # Use optimized request_completion without re-opening file
-                lsp_completions = lsp_client.request_completion(uri, line_idx, col_idx)
-                
                 # Skip if no LSP completions
                 if not lsp_completions:
                     continue
                 
                 positions_with_lsp += 1
+                if quota and len(file_samples) >= quota:
+                    continue
                 
-                # Get the top LSP completion (first one is already sorted by LSP)
-                top_lsp_completion = lsp_completions[0]
-                
+                # Context is not copied into the sample; SourceStore slices
+                # code_before/code_after out of the file on demand
                 file_samples.append({
                     'file': file_path,
-                    'trigger_token': trigger_token,
-                    'target_token': target_token,
-                    'lsp_position': target_start_pos,
-                    'code_before': code_before,
-                    'code_after': code_after,
-                    'lsp_completion': top_lsp_completion,  # Pre-computed top LSP prediction
+                    'file_id': file_idx,
+                    'trigger_token': candidate['trigger_token'],
+                    'trigger_type': candidate['trigger_type'],
+                    'target_token': candidate['target_token'],
+                    'lsp_position': candidate['start_pos'],
+                    'target_len': len(candidate['target_token']),
+                    'lsp_completion': lsp_completions[0],  # Pre-computed top LSP prediction (already sorted by LSP)
                     'lsp_count': len(lsp_completions)  # Number of LSP suggestions
                 })
-            
-            # Add file samples
-            # If we have too many, randomly select K but keep them sorted by position
-            if self.max_samples_per_file and len(file_samples) > self.max_samples_per_file:
-                file_samples = sorted(random.sample(file_samples, self.max_samples_per_file), 
-                                   key=lambda x: x['lsp_position'])
-            
-            samples.extend(file_samples)
-            
-            if files_processed % 10 == 0:
-                print(f"  Processed {files_processed}/{len(file_list)} files, {len(samples)} samples so far...")
         
-        print(f"\n✅ Sample Generation Complete:")
-        print(f"   Files processed: {files_processed}")
-        print(f"   Total positions checked: {total_positions_checked}")
-        print(f"   Positions with LSP completions: {positions_with_lsp}")
-        print(f"   Final samples: {len(samples)}")
-        print(f"   Avg samples per file: {len(samples)/files_processed:.1f}")
-        
-        return samples
+        # Keep samples sorted by position
+        file_samples.sort(key=lambda x: x['lsp_position'])
+
+        return {
+            'samples': file_samples,
+            'positions_checked': positions_checked,
+            'positions_with_lsp': positions_with_lsp,
+            'lsp_queries': lsp_queries,
+            'lsp_timeouts': lsp_timeouts,
+        }
     
     def save_samples(self, samples):
         """Save samples to JSON file."""
         os.makedirs(os.path.dirname(self.samples_file), exist_ok=True)
         with open(self.samples_file, 'w') as f:
-            json.dump(samples, f, indent=2)
+            json.dump(samples, f, separators=(',', ':'))
         print(f"\n💾 Saved {len(samples)} samples to {self.samples_file}")
     
     def load_samples(self):
@@ -155,14 +282,17 @@ class SampleGenerator:
         print(f"📂 Loaded {len(samples)} samples from {self.samples_file}")
         return samples
     
-    def get_samples(self, data_list, lsp_client, regenerate=False):
+    def get_samples(self, data_list, lsp_client, regenerate=False, num_shards=1, lsp_cmd=None, root_uri=None):
         """
         Get samples - load from cache or generate fresh.
         
         Args:
-            data_list: List of dicts with 'file' and 'tokens' keys
+            data_list: TokenStore (or list of dicts with 'file' and 'tokens' keys)
             lsp_client: LSPClient instance
             regenerate: If True, regenerate even if cache exists
+            num_shards: Number of LSP server processes used for generation
+            lsp_cmd: LSP server command for each shard
+            root_uri: Workspace root for each shard
         """
         if not regenerate:
             cached_samples = self.load_samples()
@@ -170,7 +300,8 @@ class SampleGenerator:
                 return cached_samples
         
         print("🔨 Generating new samples...")
-        samples = self.generate_samples(data_list, lsp_client)
+        samples = self.generate_samples(data_list, lsp_client, num_shards=num_shards,
+                                        lsp_cmd=lsp_cmd, root_uri=root_uri)
         self.save_samples(samples)
         
         return samples
\ No newline at end of file
@@ -3,22 +3,96 @@ HTTP client for the real Scalpel Rust server.
 Replaces LocalCodeModel for evaluating the deployed system.
 """
 
+import asyncio
 import requests
 import time
+from dataclasses import dataclass
 from typing import Optional
+from requests.adapters import HTTPAdapter
+
+# Responses worth retrying: the server or llama-server is busy or restarting
+RETRY_STATUSES = (502, 503, 504)
+
+
+@dataclass
+class CompletionResult:
+    """Outcome of one /complete request; `error` is None on success."""
+    completion: Optional[str] = None
+    error: Optional[str] = None
+    status: Optional[int] = None
+    server_latency_ms: Optional[float] = None
+    timings: Optional[dict] = None  # Server stage timings (tokenize/truncate/generate)
+    attempts: int = 0
+    cached: bool = False  # Served from the eval harness completion cache
+    server_cache: Optional[str] = None  # "exact"/"typeahead" when the server answered from its response cache
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _backoff_delay(backoff: float, attempt: int) -> float:
+    """Exponential backoff before retry number `attempt` (1-based)."""
+    return backoff * (2 ** (attempt - 1))
+
+
+def _request_overrides(max_context, max_predict, split_ratio) -> dict:
+    """Optional /complete fields; omitted ones fall back to the server's config."""
+    overrides = {
+        "max_context": int(max_context) if max_context is not None else None,
+        "max_predict": int(max_predict) if max_predict is not None else None,
+        "split_ratio": float(split_ratio) if split_ratio is not None else None,
+    }
+    return {k: v for k, v in overrides.items() if v is not None}
+
+
+def _request_body(code_before: str, code_after: str, overrides: dict,
+                  document: Optional[str], session: Optional[str]) -> dict:
+    """
+    /complete payload. `document` lets the server reuse work across requests
+    for one buffer; a newer request with the same `session` aborts this one
+    (it then fails with 409).
+    """
+    body = {"prefix": code_before, "suffix": code_after, **overrides}
+    if document is not None:
+        body["document"] = document
+    if session is not None:
+        body["session"] = session
+    return body
+
 
 class ScalpelServerClient:
-    def __init__(self, server_url: str = "http://localhost:3000", model_path: str = None):
+    def __init__(self, server_url: str = "http://localhost:3000", model_path: str = None,
+                 pool_size: int = 16, timeout: float = 10.0, max_retries: int = 2, backoff: float = 0.1,
+                 max_context: int = None, max_predict: int = None, split_ratio: float = None):
         """
         Initialize client for Scalpel Rust server.
-        
+
         Args:
             server_url: Base URL of the Rust server (default: http://localhost:3000)
             model_path: Path to model (optional, for logging)
+            pool_size: Keep-alive connections kept open (match eval concurrency)
+            timeout: Per-request timeout in seconds
+            max_retries: Retries for connection errors, timeouts and 502/503/504
+            backoff: Base delay in seconds, doubled on each retry
+            max_context: Per-request context budget (must fit the server's ctx size)
+            max_predict: Per-request max tokens to predict
+            split_ratio: Per-request prefix share of the budget when truncating
         """
         self.server_url = server_url.rstrip('/')
         self.model_path = model_path or "Scalpel Rust Server"
-        
+        self.overrides = _request_overrides(max_context, max_predict, split_ratio)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        # One pooled session: connections are reused instead of paying a
+        # TCP handshake (and an ephemeral port) per sample
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
     def health_check(self) -> bool:
         """Check if server is running (alias for ping)."""
         return self.ping()
@@ -26,45 +100,172 @@ class ScalpelServerClient:
     def ping(self) -> bool:
         """Check if server is running."""
         try:
-            response = requests.get(f"{self.server_url}/health", timeout=1)
+            response = self.session.get(f"{self.server_url}/health", timeout=1)
             return response.status_code == 200
-        except:
+        except requests.exceptions.RequestException:
             return False
-    
+
+    def complete(self, code_before: str, code_after: str, document: str = None,
+                 session: str = None) -> CompletionResult:
+        """
+        Request completion from Rust server, retrying transient failures.
+
+        Args:
+            code_before: Code before cursor
+            code_after: Code after cursor
+            document: Optional document id; the server reuses tokenization between requests for it
+            session: Optional session id; a newer request from the same session aborts this one
+
+        Returns:
+            CompletionResult with either the completion or a structured error
+        """
+        result = CompletionResult()
+        while True:
+            result.attempts += 1
+            retryable = False
+            try:
+                response = self.session.post(
+                    f"{self.server_url}/complete",
+                    json=_request_body(code_before, code_after, self.overrides, document, session),
+                    timeout=self.timeout
+                )
+                result.status = response.status_code
+
+                if response.status_code == 200:
+                    data = response.json()
+                    result.completion = data.get("completion", "")
+                    result.server_latency_ms = data.get("latency_ms")
+                    result.timings = data.get("timings")
+                    result.server_cache = data.get("cache")
+                    result.error = None
+                    return result
+
+                result.error = f"Server returned status {response.status_code}: {response.text}"
+                retryable = response.status_code in RETRY_STATUSES
+
+            except requests.exceptions.Timeout:
+                result.error = "Request timed out"
+                retryable = True
+            except requests.exceptions.ConnectionError:
+                result.error = f"Failed to connect to server at {self.server_url}"
+                retryable = True
+            except (requests.exceptions.RequestException, ValueError) as e:
+                result.error = f"Error requesting completion: {e}"
+
+            if not retryable or result.attempts > self.max_retries:
+                return result
+            time.sleep(_backoff_delay(self.backoff, result.attempts))
+
     def generate(self, code_before: str, code_after: str) -> Optional[str]:
         """
         Request completion from Rust server.
-        
+
         Args:
             code_before: Code before cursor
             code_after: Code after cursor
-            
+
         Returns:
             Predicted completion string, or None if request fails
         """
-        try:
-            response = requests.post(
-                f"{self.server_url}/complete",
-                json={
-                    "prefix": code_before,
-                    "suffix": code_after
-                },
-                timeout=10  # 10 second timeout
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                return data.get("completion", "")
-            else:
-                print(f"Server returned status {response.status_code}: {response.text}")
-                return None
-                
-        except requests.exceptions.Timeout:
-            print("Request timed out")
-            return None
-        except requests.exceptions.ConnectionError:
-            print(f"Failed to connect to server at {self.server_url}")
-            return None
-        except Exception as e:
-            print(f"Error requesting completion: {e}")
+        result = self.complete(code_before, code_after)
+        if not result.ok:
+            print(result.error)
             return None
+        return result.completion
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncScalpelServerClient:
+    """
+    asyncio-native client for the Scalpel Rust server.
+
+    Use as an async context manager so the connection pool is opened and
+    closed with the event loop:
+
+        async with AsyncScalpelServerClient(max_connections=64) as client:
+            results = await asyncio.gather(*(client.complete(p, s) for p, s in pairs))
+    """
+
+    def __init__(self, server_url: str = "http://localhost:3000", model_path: str = None,
+                 max_connections: int = 64, timeout: float = 10.0, max_retries: int = 2, backoff: float = 0.1,
+                 max_context: int = None, max_predict: int = None, split_ratio: float = None):
+        self.server_url = server_url.rstrip('/')
+        self.model_path = model_path or "Scalpel Rust Server"
+        self.overrides = _request_overrides(max_context, max_predict, split_ratio)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = None
+
+    async def __aenter__(self):
+        import aiohttp  # Only needed for the async transport
+
+        self._aiohttp = aiohttp
+        connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=30)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def ping(self) -> bool:
+        """Check if server is running."""
+        try:
+            async with self.session.get(f"{self.server_url}/health", timeout=self._aiohttp.ClientTimeout(total=1)) as response:
+                return response.status == 200
+        except (self._aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    async def complete(self, code_before: str, code_after: str, document: str = None,
+                       session: str = None) -> CompletionResult:
+        """Request completion from Rust server, retrying transient failures."""
+        result = CompletionResult()
+        while True:
+            result.attempts += 1
+            retryable = False
+            try:
+                async with self.session.post(
+                    f"{self.server_url}/complete",
+                    json=_request_body(code_before, code_after, self.overrides, document, session),
+                ) as response:
+                    result.status = response.status
+                    if response.status == 200:
+                        data = await response.json()
+                        result.completion = data.get("completion", "")
+                        result.server_latency_ms = data.get("latency_ms")
+                        result.timings = data.get("timings")
+                        result.server_cache = data.get("cache")
+                        result.error = None
+                        return result
+
+                    result.error = f"Server returned status {response.status}: {await response.text()}"
+                    retryable = response.status in RETRY_STATUSES
+
+            except asyncio.TimeoutError:
+                result.error = "Request timed out"
+                retryable = True
+            except self._aiohttp.ClientConnectionError:
+                result.error = f"Failed to connect to server at {self.server_url}"
+                retryable = True
+            except (self._aiohttp.ClientError, ValueError) as e:
+                result.error = f"Error requesting completion: {e}"
+
+            if not retryable or result.attempts > self.max_retries:
+                return result
+            await asyncio.sleep(_backoff_delay(self.backoff, result.attempts))
+
+    async def generate(self, code_before: str, code_after: str) -> Optional[str]:
+        """Request completion; returns None if the request fails."""
+        result = await self.complete(code_before, code_after)
+        return result.completion if result.ok else None
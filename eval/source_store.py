@@ -0,0 +1,54 @@
+"""
+Shared file-content store for lazily materializing sample context.
+
+Samples only record where the target is (file + lsp_position + target_len);
+the prefix and suffix are sliced out of the file contents on demand.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+
+class SourceStore:
+    """Reads source files once and keeps the most recently used in memory."""
+
+    def __init__(self, basedir, max_files=256):
+        self.basedir = basedir
+        self.max_files = max_files
+        self._contents = OrderedDict()
+        # Evaluation workers share one store
+        self._lock = threading.Lock()
+
+    def read(self, file_path):
+        """Return the contents of a file relative to basedir."""
+        with self._lock:
+            code = self._contents.get(file_path)
+            if code is not None:
+                self._contents.move_to_end(file_path)
+                return code
+
+        with open(os.path.join(self.basedir, file_path), 'r') as f:
+            code = f.read()
+
+        with self._lock:
+            self._contents[file_path] = code
+            if len(self._contents) > self.max_files:
+                self._contents.popitem(last=False)
+        return code
+
+    def context(self, sample):
+        """
+        Materialize (code_before, code_after) for a sample.
+
+        The target token itself is excluded from code_after, otherwise the
+        answer would be in the suffix.
+        """
+        # Samples generated before the offset-based format carry their context
+        if 'code_before' in sample:
+            return sample['code_before'], sample['code_after']
+
+        code = self.read(sample['file'])
+        pos = sample['lsp_position']
+        target_len = sample.get('target_len', len(sample['target_token']))
+        return code[:pos], code[pos + target_len:]
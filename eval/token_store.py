@@ -0,0 +1,126 @@
+"""
+Columnar, memory-mapped token cache.
+
+Layout of a store directory:
+    meta.json       file paths and the interned token vocabulary
+    offsets.npy     int64, per-file [start, end) rows into the token arrays
+    token_ids.npy   int32, index into the vocabulary
+    start_pos.npy   int64, character offset of each token in its file
+    token_type.npy  int16, tokenize token type
+"""
+
+import os
+import json
+import numpy as np
+
+META_FILE = "meta.json"
+ARRAY_FILES = ("offsets", "token_ids", "start_pos", "token_type")
+
+
+class TokenStore:
+    """Read-only view over a token store; loads one file's tokens at a time."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE), 'r') as f:
+            meta = json.load(f)
+        self.files = meta['files']
+        self.vocab = meta['vocab']
+
+        # Memory-map the columns so only touched pages are read from disk
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+            for name in ARRAY_FILES
+        }
+        self.offsets = arrays['offsets']
+        self.token_ids = arrays['token_ids']
+        self.start_pos = arrays['start_pos']
+        self.token_type = arrays['token_type']
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, META_FILE))
+
+    @staticmethod
+    def write(path, files_with_tokens):
+        """
+        Write tokenizer output to a store directory.
+
+        Args:
+            path: Store directory (created if missing)
+            files_with_tokens: Iterable of dicts with 'file' and 'tokens' keys (consumed once)
+        """
+        os.makedirs(path, exist_ok=True)
+
+        vocab = []
+        vocab_ids = {}
+        files = []
+        offsets = [0]
+        # One compact array per file, concatenated at the end, instead of
+        # Python int lists for the whole corpus
+        token_ids = []
+        start_pos = []
+        token_type = []
+
+        for file_data in files_with_tokens:
+            files.append(file_data['file'])
+            tokens = file_data['tokens']
+            ids = []
+            for tok in tokens:
+                value = tok['value']
+                tok_id = vocab_ids.get(value)
+                if tok_id is None:
+                    tok_id = len(vocab)
+                    vocab_ids[value] = tok_id
+                    vocab.append(value)
+                ids.append(tok_id)
+            token_ids.append(np.array(ids, dtype=np.int32))
+            start_pos.append(np.array([tok['start_pos'] for tok in tokens], dtype=np.int64))
+            token_type.append(np.array([tok['type'] for tok in tokens], dtype=np.int16))
+            offsets.append(offsets[-1] + len(tokens))
+
+        np.save(os.path.join(path, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+        for name, chunks, dtype in (("token_ids", token_ids, np.int32),
+                                    ("start_pos", start_pos, np.int64),
+                                    ("token_type", token_type, np.int16)):
+            np.save(os.path.join(path, f"{name}.npy"),
+                    np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype))
+            chunks.clear()  # Free each column's chunks before building the next
+
+        # Written last: its presence marks the store as complete
+        with open(os.path.join(path, META_FILE), 'w') as f:
+            json.dump({'files': files, 'vocab': vocab}, f)
+
+    @property
+    def total_tokens(self):
+        return int(self.offsets[-1])
+
+    def token_count(self, idx):
+        return int(self.offsets[idx + 1] - self.offsets[idx])
+
+    def tokens(self, idx):
+        """Materialize one file's tokens as {value, start_pos, type} dicts."""
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        vocab = self.vocab
+        return [
+            {'value': vocab[tok_id], 'start_pos': pos, 'type': toknum}
+            for tok_id, pos, toknum in zip(
+                self.token_ids[start:end].tolist(),
+                self.start_pos[start:end].tolist(),
+                self.token_type[start:end].tolist(),
+            )
+        ]
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, idx):
+        return {
+            'file': self.files[idx],
+            'token_count': self.token_count(idx),
+            'tokens': self.tokens(idx),
+        }
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
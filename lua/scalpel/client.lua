@@ -9,12 +9,16 @@ Main Functions:
   - request(method, endpoint, body, callback)
     Generic HTTP request wrapper with JSON encoding/decoding
   
-  - complete(prefix, suffix, filetype, callback)
+  - complete(prefix, suffix, filetype, callback, opts)
     Request a code completion from the AI server
     Callback signature: function(response, error)
       - response: { completion: string, ... }
       - error: string | nil
 
+  - complete_stream(prefix, suffix, filetype, on_token, callback, opts)
+    Same as complete(), via the streaming endpoint: on_token(text) runs for
+    each generated piece, then callback(response, error) with the full result
+
 Architecture Notes:
   - No debouncing here - that's handled by fetcher.lua
   - Errors are silently ignored to avoid spamming the user
@@ -70,10 +74,16 @@ end
 --- @param suffix string Code after cursor
 --- @param filetype string Neovim filetype (e.g., "lua", "python")
 --- @param callback function Callback(response, error) where response has { completion: string }
-function M.complete(prefix, suffix, filetype, callback)
+--- @param opts table|nil Optional fields:
+---   document: buffer identifier; lets the server reuse work between requests
+---   session: client identifier; the server aborts this request when a newer one arrives
+function M.complete(prefix, suffix, filetype, callback, opts)
+  opts = opts or {}
   local body = {
     prefix = prefix,
     suffix = suffix,
+    document = opts.document,
+    session = opts.session,
   }
   
   M.request("POST", "/complete", body, function(response, err)
@@ -87,4 +97,62 @@ function M.complete(prefix, suffix, filetype, callback)
   end)
 end
 
+--- Requests a code completion as server-sent events
+--- @param prefix string Code before cursor
+--- @param suffix string Code after cursor
+--- @param filetype string Neovim filetype (e.g., "lua", "python")
+--- @param on_token function Called with each generated piece of text
+--- @param callback function Callback(response, error), as for complete()
+--- @param opts table|nil Same optional fields as complete()
+function M.complete_stream(prefix, suffix, filetype, on_token, callback, opts)
+  opts = opts or {}
+  local body = {
+    prefix = prefix,
+    suffix = suffix,
+    document = opts.document,
+    session = opts.session,
+  }
+
+  -- Name of the event whose data line comes next
+  local event = nil
+
+  curl.request({
+    url = config.options.server_url .. "/complete/stream",
+    method = "POST",
+    body = vim.fn.json_encode(body),
+    headers = {
+      ["Content-Type"] = "application/json",
+    },
+    stream = function(_, line)
+      if not line then return end
+      if line:sub(1, 7) == "event: " then
+        event = line:sub(8)
+        return
+      end
+      if line:sub(1, 6) ~= "data: " then return end
+
+      local name = event
+      local data = line:sub(7)
+      vim.schedule(function()
+        local ok, decoded = pcall(vim.fn.json_decode, data)
+        if not ok then return end
+
+        if name == "token" then
+          on_token(decoded.content)
+        elseif name == "done" then
+          callback(decoded, nil)
+        elseif name == "error" then
+          callback(nil, "HTTP " .. decoded.status .. ": " .. decoded.error)
+        end
+      end)
+    end,
+    callback = vim.schedule_wrap(function(response)
+      -- Errors before the stream started (e.g. a malformed request)
+      if response.status ~= 200 then
+        callback(nil, "HTTP " .. response.status)
+      end
+    end),
+  })
+end
+
 return M
@@ -17,6 +17,10 @@ Configuration Options:
     Optional keybindings for triggering manual completion.
     Example: { complete = "<C-k>" }
 
+  - stream: boolean (default: true)
+    Show the prediction as soon as its first token arrives instead of
+    waiting for the whole completion.
+
 Usage:
   require("scalpel").setup({
     port = 8080,
@@ -38,6 +42,9 @@ M.defaults = {
   keymaps = {
     complete = nil,
   },
+
+  -- Stream predictions token by token
+  stream = true,
 }
 
 --- Active configuration (set by setup())
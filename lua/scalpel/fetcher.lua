@@ -13,14 +13,19 @@ How It Works:
   4. Updates state.prediction on success
   5. Triggers nvim-cmp re-sort to boost matching items
 
+  With config.stream, the prediction is shown as soon as the first
+  identifier token arrives and refreshed once the full completion is in.
+
 Request Cancellation:
   Uses sequence numbers to ignore stale responses. If you type "abc" then
   quickly change it to "xyz", the "abc" response is discarded even if it
   arrives later. This prevents UI jitter from out-of-order responses.
+  Every request also carries this Neovim instance's session id, so the
+  server aborts the "abc" generation as soon as the "xyz" request arrives.
 
 Performance:
   - 100ms debounce: Balances responsiveness vs server load
-  - Logical cancellation: Old responses ignored (not true HTTP cancellation)
+  - Server-side cancellation: Superseded requests stop generating
   - Non-blocking: LSP completions show immediately, AI boosts them later
 --]]
 
@@ -37,6 +42,9 @@ local timer = nil
 -- Increments with each new request; responses check if they're still current
 local request_seq = 0
 
+-- Identifies this Neovim instance to the server, which keeps only its latest request running
+local session = "nvim-" .. vim.fn.getpid()
+
 --- Sets up autocommands for background fetching
 function M.setup()
   local group = vim.api.nvim_create_augroup("ScalpelFetcher", { clear = true })
@@ -90,33 +98,63 @@ function M.fetch_prediction()
   local prefix = table.concat(prefix_lines, "\n")
   local suffix = table.concat(suffix_lines, "\n")
   local filetype = vim.bo[buf].filetype
+  local document = vim.api.nvim_buf_get_name(buf)
+  if document == "" then
+    document = "buffer:" .. buf
+  end
 
   -- Assign sequence number to this request
   request_seq = request_seq + 1
   local current_seq = request_seq
 
-  -- Make async request to AI server
-  client.complete(prefix, suffix, filetype, function(res, err)
+  local opts = { document = document, session = session }
+
+  --- Updates the shared prediction, re-sorting nvim-cmp items if it changed
+  local function show(prediction)
+    if prediction == state.prediction then return end
+    state.prediction = prediction
+
+    -- Trigger nvim-cmp to re-sort items with new prediction
+    -- This causes the comparator to run and boost matching items
+    local current_mode = vim.api.nvim_get_mode().mode
+    if current_mode:sub(1, 1) == "i" then
+      require("cmp").complete()
+    end
+  end
+
+  local function on_done(res, err)
     -- Ignore stale responses (user kept typing, newer request in flight)
     if current_seq ~= request_seq then
       return
     end
 
     if not err and res and res.completion then
-      -- Update shared state with new prediction
-      state.prediction = res.completion
-      
-      -- Trigger nvim-cmp to re-sort items with new prediction
-      -- This causes the comparator to run and boost matching items
-      local current_mode = vim.api.nvim_get_mode().mode
-      if current_mode:sub(1, 1) == "i" then
-        require("cmp").complete()
-      end
+      show(res.completion)
     else
       -- Clear prediction on error
       state.prediction = nil
     end
-  end)
+  end
+
+  -- Make async request to AI server
+  if not config.options.stream then
+    client.complete(prefix, suffix, filetype, on_done, opts)
+    return
+  end
+
+  -- Text streamed so far, until it contains the start of an identifier
+  local streamed = ""
+  client.complete_stream(prefix, suffix, filetype, function(text)
+    if streamed == nil or current_seq ~= request_seq then
+      return
+    end
+    streamed = streamed .. text
+    -- Show the first identifier token right away; the rest arrives with on_done
+    if streamed:find("[%w_]") then
+      show(streamed)
+      streamed = nil
+    end
+  end, on_done, opts)
 end
 
 return M
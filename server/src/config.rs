@@ -29,6 +29,14 @@ impl Config {
             .parse()
             .map_err(|_| "Invalid SCALPEL_THREADS")?;
 
+        let parallel = std::env::var("SCALPEL_PARALLEL")
+            .unwrap_or_else(|_| "1".to_string())
+            .parse()
+            .map_err(|_| "Invalid SCALPEL_PARALLEL")?;
+        if parallel == 0 {
+            return Err("SCALPEL_PARALLEL must be at least 1".to_string());
+        }
+
         let gpu_layers = std::env::var("SCALPEL_GPU_LAYERS")
             .unwrap_or_else(|_| "-1".to_string())
             .parse()
@@ -42,6 +50,7 @@ impl Config {
             max_context,
             max_predict,
             threads,
+            parallel,
             gpu_layers,
         })
     }
@@ -1,102 +1,446 @@
+use std::convert::Infallible;
 use std::sync::Arc;
 use axum::{
     extract::State,
-    http::StatusCode,
+    http::{header::{HeaderName, CONTENT_TYPE}, StatusCode},
+    response::sse::{Event, Sse},
     Json,
 };
-use crate::types::{AppState, CompletionRequest, CompletionResponse, ErrorResponse, LlamaRequest, LlamaResponse};
+use tokio::sync::mpsc;
+use tokio_stream::wrappers::UnboundedReceiverStream;
+use crate::types::{AppState, CompletionRequest, CompletionResponse, ErrorResponse, LlamaRequest, LlamaResponse, StageTimings};
+use crate::metrics::{LlamaCall, Outcome, Stage};
 use crate::model::{build_fim_prompt, stop_tokens};
+use crate::token_cache::{apply_splice, plan_splice, Part, TokenizedText};
+use crate::truncation::stable_window_start;
 
-use crate::llama::{tokenize, detokenize};
+use crate::llama::{tokenize, tokenize_with_pieces, detokenize};
 
 const SPLIT_RATIO: f32 = 0.75;
 
+fn elapsed_ms(since: std::time::Instant) -> f64 {
+    since.elapsed().as_secs_f64() * 1000.0
+}
+
+/// Context limits for one request: server defaults plus request overrides.
+struct Limits {
+    max_context: usize,
+    max_predict: i8,
+    split_ratio: f32,
+}
+
+impl Limits {
+    /// Identifies these limits in the response cache.
+    fn key(&self) -> u64 {
+        ((self.max_context as u64) << 40) ^ ((self.max_predict as u8 as u64) << 32) ^ self.split_ratio.to_bits() as u64
+    }
+}
+
+fn bad_request(error: String) -> (StatusCode, Json<ErrorResponse>) {
+    (StatusCode::BAD_REQUEST, Json(ErrorResponse { error }))
+}
+
+fn resolve_limits(state: &AppState, request: &CompletionRequest) -> Result<Limits, (StatusCode, Json<ErrorResponse>)> {
+    let max_context = request.max_context.unwrap_or(state.max_context);
+    let max_predict = request.max_predict.unwrap_or(state.max_predict);
+    let split_ratio = request.split_ratio.unwrap_or(SPLIT_RATIO);
+
+    // Each llama-server slot has a context of state.max_context tokens
+    // (--ctx-size is max_context * parallel, split between the slots)
+    if max_context == 0 || max_context > state.max_context {
+        return Err(bad_request(format!(
+            "max_context must be between 1 and the loaded ctx size ({}), got {}",
+            state.max_context, max_context
+        )));
+    }
+    if max_predict <= 0 || max_predict as usize >= max_context {
+        return Err(bad_request(format!(
+            "max_predict must be positive and below max_context ({}), got {}",
+            max_context, max_predict
+        )));
+    }
+    if !(split_ratio > 0.0 && split_ratio < 1.0) {
+        return Err(bad_request(format!(
+            "split_ratio must be between 0 and 1 (exclusive), got {}",
+            split_ratio
+        )));
+    }
+
+    Ok(Limits { max_context, max_predict, split_ratio })
+}
+
+/// Tokens of a prefix or suffix; `Cached` ones carry byte offsets so they
+/// can be truncated without /detokenize.
+enum Tokenized {
+    Cached(Arc<TokenizedText>),
+    Plain(Vec<u32>),
+}
+
+impl Tokenized {
+    fn len(&self) -> usize {
+        match self {
+            Tokenized::Cached(t) => t.len(),
+            Tokenized::Plain(tokens) => tokens.len(),
+        }
+    }
+}
+
+/// Tokenize `text`, sending only the part that changed since the document's
+/// previous request to llama-server. Returns the tokens and how many were reused.
+async fn tokenize_incremental(state: &AppState, document: &str, part: Part, text: &str) -> Result<(Tokenized, usize), reqwest::Error> {
+    if !state.token_cache.is_enabled() {
+        let tokens = tokenize(&state.client, &state.llama_url, text).await?;
+        return Ok((Tokenized::Plain(tokens), 0));
+    }
+
+    let cached = state.token_cache.get(document, part);
+    if let Some(old) = &cached {
+        if old.text == text {
+            let reused = old.len();
+            return Ok((Tokenized::Cached(old.clone()), reused));
+        }
+    }
+
+    let splice = cached.as_ref().map(|old| plan_splice(old, text));
+    let range = splice.as_ref().map_or(0..text.len(), |s| s.middle.clone());
+    let middle_text = text[range].to_string();
+    let pieces = if middle_text.is_empty() {
+        Vec::new()
+    } else {
+        match tokenize_with_pieces(&state.client, &state.llama_url, &middle_text).await {
+            Ok(pieces) => pieces,
+            // Older llama-server builds ignore with_pieces and answer with
+            // plain token ids: stop asking and tokenize whole texts instead
+            Err(e) if e.is_decode() => {
+                state.token_cache.disable();
+                let tokens = tokenize(&state.client, &state.llama_url, text).await?;
+                return Ok((Tokenized::Plain(tokens), 0));
+            }
+            Err(e) => return Err(e),
+        }
+    };
+
+    let Some(middle) = TokenizedText::from_pieces(middle_text, pieces) else {
+        // This tokenizer's pieces don't map back onto the text, so offsets
+        // can't be trusted: fall back to whole-text tokenization for good
+        state.token_cache.disable();
+        let tokens = tokenize(&state.client, &state.llama_url, text).await?;
+        return Ok((Tokenized::Plain(tokens), 0));
+    };
+
+    let (tokenized, reused) = match (&cached, &splice) {
+        (Some(old), Some(splice)) => (
+            apply_splice(old, text.to_string(), splice, middle),
+            old.len() - (splice.tail_start - splice.head_tokens),
+        ),
+        _ => (middle, 0),
+    };
+    let tokenized = Arc::new(tokenized);
+    state.token_cache.insert(document, part, tokenized.clone());
+    Ok((Tokenized::Cached(tokenized), reused))
+}
+
+/// Text of the last `n` prefix tokens or the first `n` suffix tokens.
+async fn keep_tokens(state: &AppState, tokenized: &Tokenized, text: &str, part: Part, n: usize) -> Result<String, reqwest::Error> {
+    if n >= tokenized.len() {
+        return Ok(text.to_string());
+    }
+    match tokenized {
+        Tokenized::Cached(t) => Ok(match part {
+            Part::Prefix => t.tail_text(n),
+            Part::Suffix => t.head_text(n),
+        }.to_string()),
+        Tokenized::Plain(tokens) => {
+            let kept = match part {
+                Part::Prefix => &tokens[tokens.len() - n..],
+                Part::Suffix => &tokens[..n],
+            };
+            detokenize(&state.client, &state.llama_url, kept).await
+        }
+    }
+}
+
+/// Await `future`, returning its output and how long it took in ms.
+async fn timed<F: std::future::Future>(future: F) -> (F::Output, f64) {
+    let start = std::time::Instant::now();
+    let output = future.await;
+    (output, elapsed_ms(start))
+}
+
+/// Count a failed llama-server call and turn it into an error response.
+fn llama_failure(state: &AppState, call: LlamaCall, status: StatusCode, error: String) -> (StatusCode, Json<ErrorResponse>) {
+    state.metrics.llama_error(call);
+    (status, Json(ErrorResponse { error }))
+}
+
+/// Receives each generated piece of text as llama-server streams it.
+type TokenSink<'a> = Option<&'a (dyn Fn(&str) + Send + Sync)>;
+
 pub async fn handle_complete(
     State(state): State<Arc<AppState>>,
     Json(request): Json<CompletionRequest>
 ) -> Result<Json<CompletionResponse>, (StatusCode, Json<ErrorResponse>)> {
+    run(&state, request, None).await.map(Json)
+}
+
+/// Like /complete, but as server-sent events: a `token` event per generated
+/// piece, then `done` with the full CompletionResponse (or `error`).
+pub async fn handle_complete_stream(
+    State(state): State<Arc<AppState>>,
+    Json(request): Json<CompletionRequest>
+) -> Sse<UnboundedReceiverStream<Result<Event, Infallible>>> {
+    let (events, receiver) = mpsc::unbounded_channel();
+
+    tokio::spawn(async move {
+        let on_token = |piece: &str| {
+            let data = serde_json::json!({ "content": piece }).to_string();
+            let _ = events.send(Ok(Event::default().event("token").data(data)));
+        };
+        let result = tokio::select! {
+            result = run(&state, request, Some(&on_token)) => result,
+            // Client went away: dropping run() cancels the generation
+            _ = events.closed() => return,
+        };
+        let event = match result {
+            Ok(response) => Event::default()
+                .event("done")
+                .data(serde_json::to_string(&response).unwrap_or_default()),
+            Err((status, Json(error))) => Event::default()
+                .event("error")
+                .data(serde_json::json!({ "status": status.as_u16(), "error": error.error }).to_string()),
+        };
+        let _ = events.send(Ok(event));
+    });
+
+    Sse::new(UnboundedReceiverStream::new(receiver))
+}
+
+/// Run one completion request, recording metrics and superseding the
+/// session's previous request.
+async fn run(
+    state: &AppState,
+    request: CompletionRequest,
+    on_token: TokenSink<'_>,
+) -> Result<CompletionResponse, (StatusCode, Json<ErrorResponse>)> {
     let start = std::time::Instant::now();
+    let _in_flight = state.metrics.enter_request();
 
-    // 1. Tokenize prefix and suffix
-    let prefix_tokens = tokenize(&state.client, &state.llama_url, &request.prefix).await
-        .map_err(|e| (StatusCode::INTERNAL_SERVER_ERROR, Json(ErrorResponse { error: format!("Tokenization failed: {}", e) })))?;
-        
-    let suffix_tokens = tokenize(&state.client, &state.llama_url, &request.suffix).await
-        .map_err(|e| (StatusCode::INTERNAL_SERVER_ERROR, Json(ErrorResponse { error: format!("Tokenization failed: {}", e) })))?;
+    let result = match request.session.clone() {
+        Some(session) => {
+            // Dropping the losing future aborts its pending tokenize calls and
+            // closes its llama-server connection, which cancels the generation
+            let ticket = state.sessions.begin(&session);
+            let result = tokio::select! {
+                result = complete(state, request, start, on_token) => result,
+                _ = ticket.superseded() => Err((
+                    StatusCode::CONFLICT,
+                    Json(ErrorResponse { error: "Superseded by a newer request from the same session".to_string() }),
+                )),
+            };
+            state.sessions.finish(&session, &ticket);
+            result
+        }
+        None => complete(state, request, start, on_token).await,
+    };
+
+    state.metrics.stage(Stage::Total, elapsed_ms(start));
+    state.metrics.request_done(match &result {
+        Ok(_) => Outcome::Ok,
+        Err((status, _)) if *status == StatusCode::CONFLICT => Outcome::Superseded,
+        Err((status, _)) if *status == StatusCode::BAD_REQUEST => Outcome::BadRequest,
+        Err(_) => Outcome::Error,
+    });
+    result
+}
+
+async fn complete(
+    state: &AppState,
+    request: CompletionRequest,
+    start: std::time::Instant,
+    on_token: TokenSink<'_>,
+) -> Result<CompletionResponse, (StatusCode, Json<ErrorResponse>)> {
+    let mut timings = StageTimings::default();
+    let limits = resolve_limits(state, &request)?;
+    let document = request.document.as_deref().unwrap_or("");
+
+    // 0. Answer from the document's recent completions when possible. Requests
+    // without a document (benchmarks, one-off calls) always reach the model.
+    let limits_key = limits.key();
+    let hit = request.document.as_deref().and_then(|document| {
+        let hit = state.response_cache.lookup(document, &request.prefix, &request.suffix, limits_key);
+        state.metrics.response_cache(hit.as_ref().map(|(kind, _)| *kind));
+        hit
+    });
+    if let Some((kind, completion)) = hit {
+        if let Some(on_token) = on_token {
+            on_token(&completion);
+            timings.first_token_ms = Some(elapsed_ms(start));
+            state.metrics.stage(Stage::FirstToken, elapsed_ms(start));
+        }
+        return Ok(CompletionResponse {
+            completion,
+            prompt: String::new(),
+            latency_ms: start.elapsed().as_millis() as u64,
+            timings,
+            tokens_reused: 0,
+            cache: Some(kind.name()),
+            slot: None,
+            prompt_tokens_cached: 0,
+        });
+    }
+
+    // 1. Tokenize prefix and suffix (only what changed since the last request)
+    let stage = std::time::Instant::now();
+    let ((prefix_tokens, prefix_ms), (suffix_tokens, suffix_ms)) = tokio::join!(
+        timed(tokenize_incremental(state, document, Part::Prefix, &request.prefix)),
+        timed(tokenize_incremental(state, document, Part::Suffix, &request.suffix)),
+    );
+    let (prefix_tokens, prefix_reused) = prefix_tokens
+        .map_err(|e| llama_failure(state, LlamaCall::Tokenize, StatusCode::INTERNAL_SERVER_ERROR, format!("Tokenization failed: {}", e)))?;
+    let (suffix_tokens, suffix_reused) = suffix_tokens
+        .map_err(|e| llama_failure(state, LlamaCall::Tokenize, StatusCode::INTERNAL_SERVER_ERROR, format!("Tokenization failed: {}", e)))?;
+
+    timings.tokenize_ms = elapsed_ms(stage);
+    timings.tokenize_prefix_ms = prefix_ms;
+    timings.tokenize_suffix_ms = suffix_ms;
+    state.metrics.stage(Stage::TokenizePrefix, prefix_ms);
+    state.metrics.stage(Stage::TokenizeSuffix, suffix_ms);
 
     // 2. Calculate budget
-    let reserved = state.max_predict as usize;
-    let budget = if state.max_context > reserved { state.max_context - reserved } else { 0 };
+    let reserved = limits.max_predict as usize;
+    let budget = if limits.max_context > reserved { limits.max_context - reserved } else { 0 };
     
     let total_tokens = prefix_tokens.len() + suffix_tokens.len();
-    
-    // 3. Truncate if needed
+    state.metrics.prompt(total_tokens, prefix_reused + suffix_reused, total_tokens > budget);
+
+    // 3. Truncate if needed: keep END of prefix and START of suffix
+    let stage = std::time::Instant::now();
     let (final_prefix, final_suffix) = if total_tokens > budget {
-        let max_prefix = (budget as f32 * SPLIT_RATIO) as usize;
+        let max_prefix = (budget as f32 * limits.split_ratio) as usize;
         let max_suffix = budget - max_prefix;
-        
-        let trunc_prefix_tokens = if prefix_tokens.len() > max_prefix {
-            // Keep END of prefix
-            &prefix_tokens[prefix_tokens.len() - max_prefix..]
-        } else {
-            &prefix_tokens
-        };
-        
-        let trunc_suffix_tokens = if suffix_tokens.len() > max_suffix {
-            // Keep START of suffix
-            &suffix_tokens[..max_suffix]
-        } else {
-            &suffix_tokens
+
+        let p = match (&prefix_tokens, request.document.as_deref()) {
+            // Editors send a document: move the window start in coarse,
+            // line-aligned steps so the prompt head stays cacheable
+            (Tokenized::Cached(t), Some(document)) => {
+                let window_start = stable_window_start(t, max_prefix, state.window_starts.get(document));
+                state.window_starts.set(document, window_start);
+                t.text[window_start..].to_string()
+            }
+            _ => keep_tokens(state, &prefix_tokens, &request.prefix, Part::Prefix, max_prefix).await
+                .map_err(|e| llama_failure(state, LlamaCall::Detokenize, StatusCode::INTERNAL_SERVER_ERROR, format!("Detokenization failed: {}", e)))?,
         };
-        
-        // Detokenize back to string
-        let p = detokenize(&state.client, &state.llama_url, trunc_prefix_tokens).await
-             .map_err(|e| (StatusCode::INTERNAL_SERVER_ERROR, Json(ErrorResponse { error: format!("Detokenization failed: {}", e) })))?;
              
-        let s = detokenize(&state.client, &state.llama_url, trunc_suffix_tokens).await
-             .map_err(|e| (StatusCode::INTERNAL_SERVER_ERROR, Json(ErrorResponse { error: format!("Detokenization failed: {}", e) })))?;
+        let s = keep_tokens(state, &suffix_tokens, &request.suffix, Part::Suffix, max_suffix).await
+             .map_err(|e| llama_failure(state, LlamaCall::Detokenize, StatusCode::INTERNAL_SERVER_ERROR, format!("Detokenization failed: {}", e)))?;
              
         (p, s)
     } else {
-        (request.prefix, request.suffix)
+        (request.prefix.clone(), request.suffix.clone())
     };
+    timings.truncate_ms = elapsed_ms(stage);
+    state.metrics.stage(Stage::Truncate, timings.truncate_ms);
 
     let prompt = build_fim_prompt(&final_prefix, &final_suffix, state.model_type);
 
+    // Keep each document (or else session) on one slot so its KV cache survives other editors
+    let slot = request.document.as_deref()
+        .or(request.session.as_deref())
+        .map(|key| state.slots.slot_for(key));
+
     let llama_req = LlamaRequest {
         prompt: prompt,
-        n_predict: state.max_predict,
+        n_predict: limits.max_predict,
         stop: stop_tokens(),
         temperature: 0.0,
         seed: 42,
+        cache_prompt: true,
+        id_slot: slot.map_or(-1, |s| s as i32),
+        stream: on_token.is_some(),
     }; 
 
+    let stage = std::time::Instant::now();
+    let llama_in_flight = state.metrics.enter_llama();
     let completion_url = format!("{}/completion", state.llama_url);
     let response = state.client
         .post(&completion_url)
         .json(&llama_req)
         .send()
         .await
-        .map_err(|e| (
-            StatusCode::BAD_GATEWAY,
-            Json(ErrorResponse { error: e.to_string() }),
-        ))?;
+        .map_err(|e| llama_failure(state, LlamaCall::Completion, StatusCode::BAD_GATEWAY, e.to_string()))?;
+
+    let llama_response = match on_token {
+        None => response.json::<LlamaResponse>().await.map_err(|e| e.to_string()),
+        Some(on_token) => read_stream(response, on_token, start, &mut timings).await,
+    }.map_err(|e| llama_failure(state, LlamaCall::Completion, StatusCode::INTERNAL_SERVER_ERROR, e))?;
+    drop(llama_in_flight);
+    if let Some(first_token_ms) = timings.first_token_ms {
+        state.metrics.stage(Stage::FirstToken, first_token_ms);
+    }
 
-    let llama_response = response.json::<LlamaResponse>().await
-        .map_err(|e| (
-            StatusCode::INTERNAL_SERVER_ERROR,
-            Json(ErrorResponse { error: e.to_string() }),
-        ))?;
+    timings.generate_ms = elapsed_ms(stage);
+    state.metrics.stage(Stage::Completion, timings.generate_ms);
+    let prompt_evaluated = llama_response.timings.as_ref().map_or(0, |t| t.prompt_n);
+    let prompt_cached = llama_response.prompt_tokens_cached();
+    state.metrics.prompt_cache(prompt_cached, prompt_evaluated);
+
+    if let Some(document) = request.document.as_deref() {
+        state.response_cache.store(document, &request.prefix, &request.suffix, limits_key, &llama_response.content);
+    }
 
     let latency = start.elapsed().as_millis() as u64;
     
-    Ok(Json(CompletionResponse {
+    Ok(CompletionResponse {
         completion: llama_response.content,
         prompt: llama_response.prompt,
         latency_ms: latency,
-    }))
+        timings,
+        tokens_reused: prefix_reused + suffix_reused,
+        cache: None,
+        slot,
+        prompt_tokens_cached: prompt_cached,
+    })
 }
 
+/// Forward a streaming llama-server /completion response to `on_token` and
+/// assemble the final response from it.
+async fn read_stream(
+    mut response: reqwest::Response,
+    on_token: &(dyn Fn(&str) + Send + Sync),
+    start: std::time::Instant,
+    timings: &mut StageTimings,
+) -> Result<LlamaResponse, String> {
+    let mut buffer = Vec::new();
+    let mut content = String::new();
+
+    while let Some(chunk) = response.chunk().await.map_err(|e| e.to_string())? {
+        buffer.extend_from_slice(&chunk);
+        // Events are "data: {json}" lines
+        while let Some(end) = buffer.iter().position(|&b| b == b'\n') {
+            let line: Vec<u8> = buffer.drain(..=end).collect();
+            let Some(data) = line.strip_prefix(b"data: ") else { continue };
+            let mut event: LlamaResponse = serde_json::from_slice(data).map_err(|e| e.to_string())?;
+
+            if !event.content.is_empty() {
+                if timings.first_token_ms.is_none() {
+                    timings.first_token_ms = Some(elapsed_ms(start));
+                }
+                on_token(&event.content);
+                content.push_str(&event.content);
+            }
+            if event.stop {
+                event.content = content;
+                return Ok(event);
+            }
+        }
+    }
+    Err(format!("llama-server stream ended early ({})", response.status()))
+}
+
+
+pub async fn metrics(State(state): State<Arc<AppState>>) -> ([(HeaderName, &'static str); 1], String) {
+    ([(CONTENT_TYPE, "text/plain; version=0.0.4")], state.metrics.render())
+}
 
 pub async fn health_check(State(state): State<Arc<AppState>>) -> Result<&'static str, (StatusCode, &'static str)> {
     // Verify llama-server is responding by testing tokenization
@@ -1,6 +1,6 @@
 use tokio::process::{Child, Command};
 use std::time::Duration;
-use crate::types::{Config, TokenizeRequest, TokenizeResponse, DetokenizeRequest, DetokenizeResponse};
+use crate::types::{Config, TokenizeRequest, TokenizeResponse, TokenizePiecesRequest, TokenizePiecesResponse, Piece, DetokenizeRequest, DetokenizeResponse};
 use reqwest::Client;
 
 pub async fn start_llama_process(config: &Config) -> Result<Child, std::io::Error> {
@@ -13,8 +13,11 @@ pub async fn start_llama_process(config: &Config) -> Result<Child, std::io::Erro
         .arg(config.gpu_layers.to_string())
         .arg("--threads")
         .arg(config.threads.to_string())
+        .arg("--parallel")
+        .arg(config.parallel.to_string())
+        // The context is split between slots; give each one max_context
         .arg("--ctx-size")
-        .arg(config.max_context.to_string())
+        .arg((config.max_context * config.parallel as usize).to_string())
         .stdout(std::process::Stdio::null())
         .stderr(std::process::Stdio::null())
         .spawn()
@@ -48,6 +51,26 @@ pub async fn tokenize(client: &Client, base_url: &str, text: &str) -> Result<Vec
     Ok(res.tokens)
 }
 
+/// Tokenize and return each token with the bytes it spells.
+pub async fn tokenize_with_pieces(client: &Client, base_url: &str, text: &str) -> Result<Vec<(u32, Vec<u8>)>, reqwest::Error> {
+    let url = format!("{}/tokenize", base_url);
+    let req = TokenizePiecesRequest { content: text.to_string(), with_pieces: true };
+
+    let res = client.post(&url)
+        .json(&req)
+        .send()
+        .await?
+        .json::<TokenizePiecesResponse>()
+        .await?;
+
+    Ok(res.tokens.into_iter()
+        .map(|t| match t.piece {
+            Piece::Text(s) => (t.id, s.into_bytes()),
+            Piece::Bytes(b) => (t.id, b),
+        })
+        .collect())
+}
+
 pub async fn detokenize(client: &Client, base_url: &str, tokens: &[u32]) -> Result<String, reqwest::Error> {
     let url = format!("{}/detokenize", base_url);
     let req = DetokenizeRequest { tokens: tokens.to_vec() };
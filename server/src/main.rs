@@ -1,16 +1,28 @@
 mod config;
 mod handlers;
 mod llama;
+mod metrics;
 mod model;
+mod response_cache;
+mod sessions;
+mod slots;
+mod token_cache;
+mod truncation;
 mod types;
 
 use std::sync::Arc;
 use axum::routing::post;
 use axum::Router;
 
-use crate::handlers::{handle_complete, health_check};
+use crate::handlers::{handle_complete, handle_complete_stream, health_check, metrics};
 use crate::llama::{start_llama_process, wait_for_server};
+use crate::metrics::Metrics;
 use crate::model::extract_model_type;
+use crate::response_cache::ResponseCache;
+use crate::sessions::Sessions;
+use crate::slots::SlotAffinity;
+use crate::token_cache::TokenCache;
+use crate::truncation::WindowStarts;
 use crate::types::{AppState, Config};
 
 #[tokio::main]
@@ -19,7 +31,7 @@ async fn main() -> Result<(), Box<dyn std::error::Error>> {
     let config = Config::from_env().map_err(|e| {
         eprintln!("Configuration error: {}", e);
         eprintln!("Required: SCALPEL_MODEL_PATH");
-        eprintln!("Optional: SCALPEL_LLAMA_BINARY, SCALPEL_PORT");
+        eprintln!("Optional: SCALPEL_LLAMA_BINARY, SCALPEL_PORT, SCALPEL_PARALLEL");
         e
     })?;
 
@@ -37,12 +49,20 @@ async fn main() -> Result<(), Box<dyn std::error::Error>> {
         model_type: extract_model_type(&config.model_path),
         max_context: config.max_context,
         max_predict: config.max_predict,
+        token_cache: TokenCache::new(),
+        metrics: Metrics::new(),
+        sessions: Sessions::new(),
+        response_cache: ResponseCache::new(),
+        slots: SlotAffinity::new(config.parallel as usize),
+        window_starts: WindowStarts::new(),
     });
 
     // Create app with endpoint routes
     let app = Router::new()
         .route("/complete", post(handle_complete)) // completion endpoint
+        .route("/complete/stream", post(handle_complete_stream)) // same, streamed as server-sent events
         .route("/health", axum::routing::get(health_check)) // healthcheck endpoint
+        .route("/metrics", axum::routing::get(metrics)) // Prometheus metrics
         .with_state(state);
 
     let addr = format!("127.0.0.1:{}", config.server_port);
@@ -0,0 +1,241 @@
+use std::fmt::Write;
+use std::sync::atomic::{AtomicI64, AtomicU64, Ordering};
+use crate::response_cache::Hit;
+
+/// Latency buckets in seconds, from a cached keystroke to a slow CPU generation.
+const DURATION_BUCKETS: &[f64] = &[0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0];
+
+const PROMPT_TOKEN_BUCKETS: &[f64] = &[64.0, 128.0, 256.0, 512.0, 1024.0, 2048.0, 4096.0, 8192.0];
+
+/// Stages of a /complete request, in the order they run.
+#[derive(Clone, Copy)]
+pub enum Stage {
+    TokenizePrefix,
+    TokenizeSuffix,
+    Truncate,
+    Completion,
+    /// Request start to the first streamed token.
+    FirstToken,
+    Total,
+}
+
+const STAGES: [(Stage, &str); 6] = [
+    (Stage::TokenizePrefix, "tokenize_prefix"),
+    (Stage::TokenizeSuffix, "tokenize_suffix"),
+    (Stage::Truncate, "truncate"),
+    (Stage::Completion, "llama_completion"),
+    (Stage::FirstToken, "first_token"),
+    (Stage::Total, "total"),
+];
+
+/// llama-server calls that can fail.
+#[derive(Clone, Copy)]
+pub enum LlamaCall {
+    Tokenize,
+    Detokenize,
+    Completion,
+}
+
+const LLAMA_CALLS: [(LlamaCall, &str); 3] = [
+    (LlamaCall::Tokenize, "tokenize"),
+    (LlamaCall::Detokenize, "detokenize"),
+    (LlamaCall::Completion, "completion"),
+];
+
+/// How a /complete request ended.
+#[derive(Clone, Copy)]
+pub enum Outcome {
+    Ok,
+    BadRequest,
+    Error,
+    /// Abandoned because a newer request from the same session arrived.
+    Superseded,
+}
+
+const OUTCOMES: [(Outcome, &str); 4] = [
+    (Outcome::Ok, "ok"),
+    (Outcome::BadRequest, "bad_request"),
+    (Outcome::Error, "error"),
+    (Outcome::Superseded, "superseded"),
+];
+
+pub struct Histogram {
+    bounds: &'static [f64],
+    counts: Vec<AtomicU64>,
+    /// Sum of observations in millionths, so it fits an atomic integer.
+    sum_micros: AtomicU64,
+}
+
+impl Histogram {
+    fn new(bounds: &'static [f64]) -> Self {
+        Self {
+            bounds,
+            // One extra bucket for +Inf
+            counts: (0..=bounds.len()).map(|_| AtomicU64::new(0)).collect(),
+            sum_micros: AtomicU64::new(0),
+        }
+    }
+
+    pub fn observe(&self, value: f64) {
+        let bucket = self.bounds.partition_point(|&b| b < value);
+        self.counts[bucket].fetch_add(1, Ordering::Relaxed);
+        self.sum_micros.fetch_add((value * 1e6) as u64, Ordering::Relaxed);
+    }
+
+    fn render(&self, out: &mut String, name: &str, labels: &str) {
+        let sep = if labels.is_empty() { "" } else { "," };
+        let mut cumulative = 0;
+        for (bound, count) in self.bounds.iter().zip(&self.counts) {
+            cumulative += count.load(Ordering::Relaxed);
+            let _ = writeln!(out, "{}_bucket{{{}{}le=\"{}\"}} {}", name, labels, sep, bound, cumulative);
+        }
+        cumulative += self.counts[self.bounds.len()].load(Ordering::Relaxed);
+        let _ = writeln!(out, "{}_bucket{{{}{}le=\"+Inf\"}} {}", name, labels, sep, cumulative);
+        let braces = if labels.is_empty() { String::new() } else { format!("{{{}}}", labels) };
+        let _ = writeln!(out, "{}_sum{} {}", name, braces, self.sum_micros.load(Ordering::Relaxed) as f64 / 1e6);
+        let _ = writeln!(out, "{}_count{} {}", name, braces, cumulative);
+    }
+}
+
+/// Decrements its gauge when dropped, so early returns are counted too.
+pub struct InFlight<'a>(&'a AtomicI64);
+
+impl Drop for InFlight<'_> {
+    fn drop(&mut self) {
+        self.0.fetch_sub(1, Ordering::Relaxed);
+    }
+}
+
+/// Server-wide counters exposed at /metrics in Prometheus text format.
+pub struct Metrics {
+    requests: [AtomicU64; 4],
+    in_flight: AtomicI64,
+    llama_in_flight: AtomicI64,
+    stages: Vec<Histogram>,
+    prompt_tokens: Histogram,
+    tokens_reused: AtomicU64,
+    truncations: AtomicU64,
+    llama_errors: [AtomicU64; 3],
+    /// Response cache lookups: miss, exact, typeahead.
+    response_cache: [AtomicU64; 3],
+    llama_prompt_cached: AtomicU64,
+    llama_prompt_evaluated: AtomicU64,
+}
+
+impl Metrics {
+    pub fn new() -> Self {
+        Self {
+            requests: Default::default(),
+            in_flight: AtomicI64::new(0),
+            llama_in_flight: AtomicI64::new(0),
+            stages: STAGES.iter().map(|_| Histogram::new(DURATION_BUCKETS)).collect(),
+            prompt_tokens: Histogram::new(PROMPT_TOKEN_BUCKETS),
+            tokens_reused: AtomicU64::new(0),
+            truncations: AtomicU64::new(0),
+            llama_errors: Default::default(),
+            response_cache: Default::default(),
+            llama_prompt_cached: AtomicU64::new(0),
+            llama_prompt_evaluated: AtomicU64::new(0),
+        }
+    }
+
+    pub fn enter_request(&self) -> InFlight<'_> {
+        self.in_flight.fetch_add(1, Ordering::Relaxed);
+        InFlight(&self.in_flight)
+    }
+
+    pub fn enter_llama(&self) -> InFlight<'_> {
+        self.llama_in_flight.fetch_add(1, Ordering::Relaxed);
+        InFlight(&self.llama_in_flight)
+    }
+
+    pub fn request_done(&self, outcome: Outcome) {
+        self.requests[outcome as usize].fetch_add(1, Ordering::Relaxed);
+    }
+
+    pub fn stage(&self, stage: Stage, ms: f64) {
+        self.stages[stage as usize].observe(ms / 1000.0);
+    }
+
+    pub fn prompt(&self, prompt_tokens: usize, tokens_reused: usize, truncated: bool) {
+        self.prompt_tokens.observe(prompt_tokens as f64);
+        self.tokens_reused.fetch_add(tokens_reused as u64, Ordering::Relaxed);
+        if truncated {
+            self.truncations.fetch_add(1, Ordering::Relaxed);
+        }
+    }
+
+    pub fn response_cache(&self, hit: Option<Hit>) {
+        let index = match hit {
+            None => 0,
+            Some(Hit::Exact) => 1,
+            Some(Hit::Typeahead) => 2,
+        };
+        self.response_cache[index].fetch_add(1, Ordering::Relaxed);
+    }
+
+    /// Prompt tokens llama-server took from its KV cache vs. evaluated.
+    pub fn prompt_cache(&self, cached: usize, evaluated: usize) {
+        self.llama_prompt_cached.fetch_add(cached as u64, Ordering::Relaxed);
+        self.llama_prompt_evaluated.fetch_add(evaluated as u64, Ordering::Relaxed);
+    }
+
+    pub fn llama_error(&self, call: LlamaCall) {
+        self.llama_errors[call as usize].fetch_add(1, Ordering::Relaxed);
+    }
+
+    pub fn render(&self) -> String {
+        let mut out = String::new();
+
+        out.push_str("# HELP scalpel_requests_total Completion requests by outcome.\n");
+        out.push_str("# TYPE scalpel_requests_total counter\n");
+        for (outcome, name) in OUTCOMES {
+            let _ = writeln!(out, "scalpel_requests_total{{outcome=\"{}\"}} {}", name, self.requests[outcome as usize].load(Ordering::Relaxed));
+        }
+
+        out.push_str("# HELP scalpel_requests_in_flight Completion requests being handled.\n");
+        out.push_str("# TYPE scalpel_requests_in_flight gauge\n");
+        let _ = writeln!(out, "scalpel_requests_in_flight {}", self.in_flight.load(Ordering::Relaxed));
+
+        out.push_str("# HELP scalpel_llama_requests_in_flight Completion calls waiting on llama-server.\n");
+        out.push_str("# TYPE scalpel_llama_requests_in_flight gauge\n");
+        let _ = writeln!(out, "scalpel_llama_requests_in_flight {}", self.llama_in_flight.load(Ordering::Relaxed));
+
+        out.push_str("# HELP scalpel_stage_duration_seconds Time spent in each stage of a completion request.\n");
+        out.push_str("# TYPE scalpel_stage_duration_seconds histogram\n");
+        for (stage, name) in STAGES {
+            self.stages[stage as usize].render(&mut out, "scalpel_stage_duration_seconds", &format!("stage=\"{}\"", name));
+        }
+
+        out.push_str("# HELP scalpel_prompt_tokens Prompt tokens (prefix + suffix) before truncation.\n");
+        out.push_str("# TYPE scalpel_prompt_tokens histogram\n");
+        self.prompt_tokens.render(&mut out, "scalpel_prompt_tokens", "");
+
+        out.push_str("# HELP scalpel_tokens_reused_total Prompt tokens reused from the per-document token cache.\n");
+        out.push_str("# TYPE scalpel_tokens_reused_total counter\n");
+        let _ = writeln!(out, "scalpel_tokens_reused_total {}", self.tokens_reused.load(Ordering::Relaxed));
+
+        out.push_str("# HELP scalpel_truncations_total Requests whose context was truncated to fit the budget.\n");
+        out.push_str("# TYPE scalpel_truncations_total counter\n");
+        let _ = writeln!(out, "scalpel_truncations_total {}", self.truncations.load(Ordering::Relaxed));
+
+        out.push_str("# HELP scalpel_response_cache_total Response cache lookups by result.\n");
+        out.push_str("# TYPE scalpel_response_cache_total counter\n");
+        for (index, name) in ["miss", "exact", "typeahead"].iter().enumerate() {
+            let _ = writeln!(out, "scalpel_response_cache_total{{result=\"{}\"}} {}", name, self.response_cache[index].load(Ordering::Relaxed));
+        }
+
+        out.push_str("# HELP scalpel_llama_prompt_tokens_total Prompt tokens llama-server reused from its KV cache or evaluated.\n");
+        out.push_str("# TYPE scalpel_llama_prompt_tokens_total counter\n");
+        let _ = writeln!(out, "scalpel_llama_prompt_tokens_total{{kind=\"cached\"}} {}", self.llama_prompt_cached.load(Ordering::Relaxed));
+        let _ = writeln!(out, "scalpel_llama_prompt_tokens_total{{kind=\"evaluated\"}} {}", self.llama_prompt_evaluated.load(Ordering::Relaxed));
+
+        out.push_str("# HELP scalpel_llama_errors_total Failed llama-server calls.\n");
+        out.push_str("# TYPE scalpel_llama_errors_total counter\n");
+        for (call, name) in LLAMA_CALLS {
+            let _ = writeln!(out, "scalpel_llama_errors_total{{call=\"{}\"}} {}", name, self.llama_errors[call as usize].load(Ordering::Relaxed));
+        }
+
+        out
+    }
+}
@@ -0,0 +1,120 @@
+use std::collections::hash_map::DefaultHasher;
+use std::collections::HashMap;
+use std::hash::{Hash, Hasher};
+use std::sync::Mutex;
+
+/// Documents whose last completion is remembered for typeahead.
+const MAX_DOCUMENTS: usize = 64;
+
+/// Exact (document, prefix, suffix, limits) results kept for backspace/undo cycles.
+const MAX_EXACT: usize = 256;
+
+/// How a request was answered without llama-server.
+#[derive(Clone, Copy)]
+pub enum Hit {
+    /// Same inputs as an earlier request.
+    Exact,
+    /// The user typed the start of the previous completion; the rest is returned.
+    Typeahead,
+}
+
+impl Hit {
+    pub fn name(self) -> &'static str {
+        match self {
+            Hit::Exact => "exact",
+            Hit::Typeahead => "typeahead",
+        }
+    }
+}
+
+struct Last {
+    used: u64,
+    prefix: String,
+    suffix: String,
+    limits: u64,
+    completion: String,
+}
+
+/// Recent completions per document.
+pub struct ResponseCache {
+    inner: Mutex<Inner>,
+}
+
+struct Inner {
+    clock: u64,
+    last: HashMap<String, Last>,
+    exact: HashMap<u64, (u64, String)>,
+}
+
+fn exact_key(document: &str, prefix: &str, suffix: &str, limits: u64) -> u64 {
+    let mut hasher = DefaultHasher::new();
+    (document, prefix, suffix, limits).hash(&mut hasher);
+    hasher.finish()
+}
+
+/// Drop the least recently used entry once `map` is full.
+fn evict<K: Clone + Eq + Hash, V>(map: &mut HashMap<K, V>, capacity: usize, used: impl Fn(&V) -> u64) {
+    if map.len() < capacity {
+        return;
+    }
+    let oldest = map.iter().min_by_key(|(_, v)| used(v)).map(|(k, _)| k.clone());
+    if let Some(oldest) = oldest {
+        map.remove(&oldest);
+    }
+}
+
+impl ResponseCache {
+    pub fn new() -> Self {
+        Self {
+            inner: Mutex::new(Inner { clock: 0, last: HashMap::new(), exact: HashMap::new() }),
+        }
+    }
+
+    /// A cached completion for these inputs, if any. `limits` identifies the
+    /// context/predict settings the completion must have been made with.
+    pub fn lookup(&self, document: &str, prefix: &str, suffix: &str, limits: u64) -> Option<(Hit, String)> {
+        let mut inner = self.inner.lock().unwrap();
+        inner.clock += 1;
+        let now = inner.clock;
+
+        if let Some((used, completion)) = inner.exact.get_mut(&exact_key(document, prefix, suffix, limits)) {
+            *used = now;
+            return Some((Hit::Exact, completion.clone()));
+        }
+
+        let last = inner.last.get_mut(document)?;
+        if last.limits != limits || last.suffix != suffix || !prefix.starts_with(last.prefix.as_str()) {
+            return None;
+        }
+        let typed = &prefix[last.prefix.len()..];
+        // Nothing typed is an exact hit; typing all of it leaves nothing to predict
+        if typed.is_empty() || typed.len() >= last.completion.len() || !last.completion.starts_with(typed) {
+            return None;
+        }
+        last.used = now;
+        Some((Hit::Typeahead, last.completion[typed.len()..].to_string()))
+    }
+
+    pub fn store(&self, document: &str, prefix: &str, suffix: &str, limits: u64, completion: &str) {
+        let mut inner = self.inner.lock().unwrap();
+        inner.clock += 1;
+        let now = inner.clock;
+
+        let key = exact_key(document, prefix, suffix, limits);
+        if !inner.exact.contains_key(&key) {
+            evict(&mut inner.exact, MAX_EXACT, |(used, _)| *used);
+        }
+        inner.exact.insert(key, (now, completion.to_string()));
+
+        if !inner.last.contains_key(document) {
+            evict(&mut inner.last, MAX_DOCUMENTS, |last| last.used);
+        }
+        inner.last.insert(document.to_string(), Last {
+            used: now,
+            prefix: prefix.to_string(),
+            suffix: suffix.to_string(),
+            limits,
+            completion: completion.to_string(),
+        });
+    }
+}
@@ -0,0 +1,66 @@
+use std::collections::HashMap;
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::sync::Mutex;
+use tokio::sync::watch;
+
+/// Latest request id of each client session. A newer request from the same
+/// session supersedes any older one still being handled.
+pub struct Sessions {
+    next_id: AtomicU64,
+    latest: Mutex<HashMap<String, watch::Sender<u64>>>,
+}
+
+/// A request's place in its session.
+pub struct Ticket {
+    id: u64,
+    latest: watch::Receiver<u64>,
+}
+
+impl Sessions {
+    pub fn new() -> Self {
+        Self {
+            next_id: AtomicU64::new(1),
+            latest: Mutex::new(HashMap::new()),
+        }
+    }
+
+    /// Register a new request for `session`, superseding the previous one.
+    pub fn begin(&self, session: &str) -> Ticket {
+        let id = self.next_id.fetch_add(1, Ordering::Relaxed);
+        let mut latest = self.latest.lock().unwrap();
+        let receiver = match latest.get(session) {
+            Some(sender) => {
+                sender.send_replace(id);
+                sender.subscribe()
+            }
+            None => {
+                let (sender, receiver) = watch::channel(id);
+                latest.insert(session.to_string(), sender);
+                receiver
+            }
+        };
+        Ticket { id, latest: receiver }
+    }
+
+    /// Forget the session if this was its latest request.
+    pub fn finish(&self, session: &str, ticket: &Ticket) {
+        let mut latest = self.latest.lock().unwrap();
+        if latest.get(session).is_some_and(|sender| *sender.borrow() == ticket.id) {
+            latest.remove(session);
+        }
+    }
+}
+
+impl Ticket {
+    /// Resolves once a newer request from the same session has arrived.
+    pub async fn superseded(&self) {
+        let mut latest = self.latest.clone();
+        while latest.changed().await.is_ok() {
+            if *latest.borrow_and_update() != self.id {
+                return;
+            }
+        }
+        // Session forgotten: nothing can supersede this request any more
+        std::future::pending::<()>().await
+    }
+}
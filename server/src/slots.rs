@@ -0,0 +1,39 @@
+use std::sync::Mutex;
+
+/// Pins documents to llama-server slots so each keeps its KV cache warm.
+/// When every slot is taken, the least recently used document loses its slot.
+pub struct SlotAffinity {
+    inner: Mutex<Inner>,
+}
+
+struct Inner {
+    clock: u64,
+    /// Owner document and last use of each slot.
+    owners: Vec<Option<(String, u64)>>,
+}
+
+impl SlotAffinity {
+    pub fn new(slots: usize) -> Self {
+        Self {
+            inner: Mutex::new(Inner { clock: 0, owners: vec![None; slots.max(1)] }),
+        }
+    }
+
+    /// Slot for `key`, assigning a free or least recently used one if needed.
+    pub fn slot_for(&self, key: &str) -> usize {
+        let mut inner = self.inner.lock().unwrap();
+        inner.clock += 1;
+        let now = inner.clock;
+
+        let slot = match inner.owners.iter().position(|o| o.as_ref().is_some_and(|(k, _)| k == key)) {
+            Some(slot) => slot,
+            None => inner.owners.iter()
+                .enumerate()
+                .min_by_key(|(_, o)| o.as_ref().map_or(0, |(_, used)| *used))
+                .map(|(slot, _)| slot)
+                .unwrap_or(0),
+        };
+        inner.owners[slot] = Some((key.to_string(), now));
+        slot
+    }
+}
@@ -0,0 +1,324 @@
+use std::collections::HashMap;
+use std::ops::Range;
+use std::sync::atomic::{AtomicBool, Ordering};
+use std::sync::{Arc, Mutex};
+
+/// Cached tokens given up on each side of an edit, in case the tokenizer
+/// would have merged across it.
+const SAFE_BOUNDARY_TOKENS: usize = 4;
+
+/// Documents remembered at once; the least recently used is dropped.
+const MAX_DOCUMENTS: usize = 64;
+
+#[derive(Clone, Copy, PartialEq, Eq, Hash)]
+pub enum Part {
+    Prefix,
+    Suffix,
+}
+
+/// A text, its tokens, and the byte offset where each token starts.
+pub struct TokenizedText {
+    pub text: String,
+    pub tokens: Vec<u32>,
+    pub offsets: Vec<usize>,
+}
+
+impl TokenizedText {
+    /// Build from llama-server's (id, piece) pairs.
+    /// Returns None if the pieces do not spell `text` exactly (e.g. the
+    /// tokenizer inserts a leading space), since offsets would be wrong.
+    pub fn from_pieces(text: String, pieces: Vec<(u32, Vec<u8>)>) -> Option<Self> {
+        let mut tokens = Vec::with_capacity(pieces.len());
+        let mut offsets = Vec::with_capacity(pieces.len());
+        let mut pos = 0;
+        for (id, piece) in pieces {
+            if !text.as_bytes()[pos..].starts_with(&piece) {
+                return None;
+            }
+            tokens.push(id);
+            offsets.push(pos);
+            pos += piece.len();
+        }
+        if pos != text.len() {
+            return None;
+        }
+        Some(Self { text, tokens, offsets })
+    }
+
+    pub fn len(&self) -> usize {
+        self.tokens.len()
+    }
+
+    fn start(&self, index: usize) -> usize {
+        self.offsets.get(index).copied().unwrap_or(self.text.len())
+    }
+
+    /// Text of the last `n` tokens (rounded inward to a char boundary).
+    pub fn tail_text(&self, n: usize) -> &str {
+        if n >= self.len() {
+            return &self.text;
+        }
+        let mut start = self.start(self.len() - n);
+        while !self.text.is_char_boundary(start) {
+            start += 1;
+        }
+        &self.text[start..]
+    }
+
+    /// Text of the first `n` tokens (rounded inward to a char boundary).
+    pub fn head_text(&self, n: usize) -> &str {
+        let mut end = self.start(n);
+        while !self.text.is_char_boundary(end) {
+            end -= 1;
+        }
+        &self.text[..end]
+    }
+}
+
+/// How to turn a cached tokenization into one of a new text.
+pub struct Splice {
+    /// Leading cached tokens that are still valid.
+    pub head_tokens: usize,
+    /// First cached token of the still-valid tail.
+    pub tail_start: usize,
+    /// Byte range of the new text that must be tokenized.
+    pub middle: Range<usize>,
+}
+
+/// A line start the tokenizer cannot merge across: right after a newline
+/// and not followed by further line breaks.
+fn is_line_boundary(text: &[u8], pos: usize) -> bool {
+    pos == 0
+        || pos == text.len()
+        || (text[pos - 1] == b'\n' && text[pos] != b'\n' && text[pos] != b'\r')
+}
+
+/// Find the span of `new` that differs from `old.text`, widened to line
+/// boundaries at least SAFE_BOUNDARY_TOKENS tokens away from the edit.
+pub fn plan_splice(old: &TokenizedText, new: &str) -> Splice {
+    let (a, b) = (old.text.as_bytes(), new.as_bytes());
+    let n = old.len();
+
+    let common_prefix = a.iter().zip(b).take_while(|(x, y)| x == y).count();
+    let max_suffix = a.len().min(b.len()) - common_prefix;
+    let common_suffix = a.iter().rev().zip(b.iter().rev())
+        .take(max_suffix)
+        .take_while(|(x, y)| x == y)
+        .count();
+
+    // Last token boundary inside the common prefix, then back off
+    let last_head = if common_prefix == a.len() {
+        n
+    } else {
+        old.offsets.partition_point(|&o| o <= common_prefix).saturating_sub(1)
+    };
+    let mut head = last_head.saturating_sub(SAFE_BOUNDARY_TOKENS);
+    while head > 0 && !is_line_boundary(b, old.start(head)) {
+        head -= 1;
+    }
+
+    // First token boundary inside the common suffix, then move forward
+    let tail_region = a.len() - common_suffix;
+    let first_tail = old.offsets.partition_point(|&o| o < tail_region);
+    let mut tail = (first_tail + SAFE_BOUNDARY_TOKENS).min(n);
+    while tail < n && !is_line_boundary(b, old.start(tail) + b.len() - a.len()) {
+        tail += 1;
+    }
+
+    Splice {
+        head_tokens: head,
+        tail_start: tail,
+        middle: old.start(head)..old.start(tail) + b.len() - a.len(),
+    }
+}
+
+/// Combine the reusable cached tokens with a fresh tokenization of the middle.
+pub fn apply_splice(old: &TokenizedText, new: String, splice: &Splice, middle: TokenizedText) -> TokenizedText {
+    let head = splice.head_tokens;
+    let tail = splice.tail_start;
+    let mut tokens = Vec::with_capacity(head + middle.len() + old.len() - tail);
+    let mut offsets = Vec::with_capacity(tokens.capacity());
+
+    tokens.extend_from_slice(&old.tokens[..head]);
+    offsets.extend_from_slice(&old.offsets[..head]);
+
+    tokens.extend_from_slice(&middle.tokens);
+    offsets.extend(middle.offsets.iter().map(|o| o + splice.middle.start));
+
+    tokens.extend_from_slice(&old.tokens[tail..]);
+    offsets.extend(old.offsets[tail..].iter().map(|o| o + new.len() - old.text.len()));
+
+    TokenizedText { text: new, tokens, offsets }
+}
+
+/// Last tokenization of each document's prefix and suffix.
+pub struct TokenCache {
+    inner: Mutex<CacheInner>,
+    /// Cleared once the tokenizer's pieces turn out not to spell their input,
+    /// or llama-server can't return pieces at all.
+    enabled: AtomicBool,
+}
+
+struct CacheInner {
+    clock: u64,
+    entries: HashMap<(String, Part), (u64, Arc<TokenizedText>)>,
+}
+
+impl TokenCache {
+    pub fn new() -> Self {
+        Self {
+            inner: Mutex::new(CacheInner { clock: 0, entries: HashMap::new() }),
+            enabled: AtomicBool::new(true),
+        }
+    }
+
+    pub fn is_enabled(&self) -> bool {
+        self.enabled.load(Ordering::Relaxed)
+    }
+
+    pub fn disable(&self) {
+        self.enabled.store(false, Ordering::Relaxed);
+        self.inner.lock().unwrap().entries.clear();
+    }
+
+    pub fn get(&self, document: &str, part: Part) -> Option<Arc<TokenizedText>> {
+        let mut inner = self.inner.lock().unwrap();
+        inner.clock += 1;
+        let now = inner.clock;
+        let (used, text) = inner.entries.get_mut(&(document.to_string(), part))?;
+        *used = now;
+        Some(text.clone())
+    }
+
+    pub fn insert(&self, document: &str, part: Part, text: Arc<TokenizedText>) {
+        let mut inner = self.inner.lock().unwrap();
+        inner.clock += 1;
+        let now = inner.clock;
+        let key = (document.to_string(), part);
+
+        if !inner.entries.contains_key(&key) && inner.entries.len() >= 2 * MAX_DOCUMENTS {
+            let oldest = inner.entries.iter()
+                .min_by_key(|(_, (used, _))| *used)
+                .map(|(k, _)| k.clone());
+            if let Some(oldest) = oldest {
+                inner.entries.remove(&oldest);
+            }
+        }
+        inner.entries.insert(key, (now, text));
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    /// Toy tokenizer: newline runs (taking any spaces before them, so an
+    /// edit can change earlier tokens), words with an optional leading space,
+    /// and single bytes for everything else (so multibyte characters are
+    /// split across pieces, like byte-level BPE does).
+    fn pieces(text: &str) -> Vec<(u32, Vec<u8>)> {
+        let b = text.as_bytes();
+        let mut out = Vec::new();
+        let mut i = 0;
+        while i < b.len() {
+            let start = i;
+            let spaces = b[i..].iter().take_while(|&&c| c == b' ').count();
+            if b.get(i + spaces) == Some(&b'\n') {
+                i += spaces;
+                while i < b.len() && b[i] == b'\n' {
+                    i += 1;
+                }
+            } else if b[i].is_ascii_alphanumeric() || (b[i] == b' ' && b.get(i + 1).is_some_and(u8::is_ascii_alphanumeric)) {
+                i += 1;
+                while i < b.len() && b[i].is_ascii_alphanumeric() {
+                    i += 1;
+                }
+            } else {
+                i += 1;
+            }
+            let piece = b[start..i].to_vec();
+            let id = piece.iter().fold(7u32, |h, &x| h.wrapping_mul(31).wrapping_add(x as u32));
+            out.push((id, piece));
+        }
+        out
+    }
+
+    fn tokenize(text: &str) -> TokenizedText {
+        TokenizedText::from_pieces(text.to_string(), pieces(text)).unwrap()
+    }
+
+    /// Re-tokenize `new` from the cached tokenization of `old` and check it
+    /// matches a full tokenization.
+    fn assert_splice_matches(old: &str, new: &str) -> Splice {
+        let cached = tokenize(old);
+        let splice = plan_splice(&cached, new);
+        let middle = tokenize(&new[splice.middle.clone()]);
+        let spliced = apply_splice(&cached, new.to_string(), &splice, middle);
+        let full = tokenize(new);
+        assert_eq!(spliced.tokens, full.tokens, "tokens for {:?} -> {:?}", old, new);
+        assert_eq!(spliced.offsets, full.offsets, "offsets for {:?} -> {:?}", old, new);
+        splice
+    }
+
+    fn document(lines: usize) -> String {
+        (0..lines).map(|i| format!("let value{} = compute(value{});\n", i, i)).collect()
+    }
+
+    #[test]
+    fn splice_edit_at_head() {
+        let old = document(40);
+        assert_splice_matches(&old, &format!("use crate::x;\n{}", old));
+        assert_splice_matches(&old, &old[5..]);
+    }
+
+    #[test]
+    fn splice_edit_at_tail() {
+        let old = document(40);
+        let splice = assert_splice_matches(&old, &format!("{}fn main() {{", old));
+        // Typing at the end only re-tokenizes the last few lines
+        assert!(splice.middle.len() < old.len() / 10);
+        assert_splice_matches(&old, &old[..old.len() - 3]);
+    }
+
+    #[test]
+    fn splice_edit_in_middle() {
+        let old = document(40);
+        let at = old.len() / 2;
+        assert_splice_matches(&old, &format!("{}x{}", &old[..at], &old[at..]));
+        assert_splice_matches(&old, &format!("{}{}", &old[..at], &old[at + 7..]));
+        assert_splice_matches(&old, &format!("{}\n\n{}", &old[..at], &old[at..]));
+        assert_splice_matches(&old, &old.replacen("value20", "renamed", 1));
+
+        // Deleting a word merges the spaces before it into the newline token
+        let old = "alpha beta    gamma\n".repeat(40);
+        let at = old.len() / 2 + 3;
+        let new = format!("{}{}", &old[..at], old[at..].replacen("gamma", "", 1));
+        assert_splice_matches(&old, &new);
+    }
+
+    #[test]
+    fn splice_multibyte_text() {
+        let old: String = (0..30).map(|i| format!("nom{} = \"café ünïcødé 日本語\"\n", i)).collect();
+        let at = old.find("日本").unwrap();
+        assert_splice_matches(&old, &format!("{}é{}", &old[..at], &old[at..]));
+        assert_splice_matches(&old, &old.replacen("café", "naïve", 3));
+        assert_splice_matches(&old, &format!("{}→", old));
+    }
+
+    #[test]
+    fn partial_text_rounds_to_char_boundary() {
+        let text = tokenize("a é b");
+        // "é" is two single-byte pieces; no slice may cut through it
+        for n in 0..=text.len() {
+            assert!(text.text.ends_with(text.tail_text(n)));
+            assert!(text.text.starts_with(text.head_text(n)));
+        }
+    }
+
+    #[test]
+    fn pieces_must_spell_the_text() {
+        // e.g. a tokenizer that adds a leading space
+        assert!(TokenizedText::from_pieces("ab".to_string(), vec![(1, b" ab".to_vec())]).is_none());
+        assert!(TokenizedText::from_pieces("ab".to_string(), vec![(1, b"a".to_vec())]).is_none());
+    }
+}
@@ -0,0 +1,85 @@
+use std::collections::HashMap;
+use std::sync::Mutex;
+use crate::token_cache::TokenizedText;
+
+/// When the window start has to move, leave this share of the prefix budget
+/// free so the next stretch of typing fits without moving it again.
+const HEADROOM: f32 = 0.25;
+
+/// Documents whose window start is remembered at once.
+const MAX_DOCUMENTS: usize = 64;
+
+fn is_line_start(text: &[u8], pos: usize) -> bool {
+    pos == 0 || text[pos - 1] == b'\n'
+}
+
+/// Byte offset where the kept part of a prefix starts, when at most
+/// `max_tokens` tokens fit.
+///
+/// Unlike keeping exactly the last `max_tokens` tokens, the start only moves
+/// when the window overflows (or shrinks to under half the budget), and then
+/// jumps to a line start leaving HEADROOM of the budget free. Consecutive
+/// keystrokes therefore produce byte-identical prompt heads, which
+/// llama-server's prompt cache can reuse.
+pub fn stable_window_start(prefix: &TokenizedText, max_tokens: usize, previous: Option<usize>) -> usize {
+    let n = prefix.len();
+    if n <= max_tokens {
+        return 0;
+    }
+    let text = prefix.text.as_bytes();
+    let target = max_tokens - (max_tokens as f32 * HEADROOM) as usize;
+
+    if let Some(start) = previous {
+        if let Ok(index) = prefix.offsets.binary_search(&start) {
+            let window = n - index;
+            if window <= max_tokens && window >= max_tokens / 2 && is_line_start(text, start) {
+                return start;
+            }
+        }
+    }
+
+    // First line start leaving at most `target` tokens, else the last one
+    // that still fits the budget
+    let first = n - target;
+    let earliest = n - max_tokens;
+    let line_start = (first..n)
+        .chain((earliest..first).rev())
+        .find(|&index| is_line_start(text, prefix.offsets[index]));
+
+    match line_start {
+        Some(index) => prefix.offsets[index],
+        // One huge line: fall back to keeping exactly max_tokens tokens
+        None => prefix.text.len() - prefix.tail_text(max_tokens).len(),
+    }
+}
+
+/// Last prefix window start of each document.
+pub struct WindowStarts {
+    inner: Mutex<(u64, HashMap<String, (u64, usize)>)>,
+}
+
+impl WindowStarts {
+    pub fn new() -> Self {
+        Self { inner: Mutex::new((0, HashMap::new())) }
+    }
+
+    pub fn get(&self, document: &str) -> Option<usize> {
+        self.inner.lock().unwrap().1.get(document).map(|(_, start)| *start)
+    }
+
+    pub fn set(&self, document: &str, start: usize) {
+        let mut inner = self.inner.lock().unwrap();
+        inner.0 += 1;
+        let now = inner.0;
+        let starts = &mut inner.1;
+        if !starts.contains_key(document) && starts.len() >= MAX_DOCUMENTS {
+            let oldest = starts.iter()
+                .min_by_key(|(_, (used, _))| *used)
+                .map(|(k, _)| k.clone());
+            if let Some(oldest) = oldest {
+                starts.remove(&oldest);
+            }
+        }
+        starts.insert(document.to_string(), (now, start));
+    }
+}
@@ -1,5 +1,11 @@
 use serde::{Serialize, Deserialize};
 use reqwest::Client;
+use crate::metrics::Metrics;
+use crate::response_cache::ResponseCache;
+use crate::sessions::Sessions;
+use crate::slots::SlotAffinity;
+use crate::truncation::WindowStarts;
+use crate::token_cache::TokenCache;
 
 #[derive(Clone, Copy)]
 pub enum ModelType {
@@ -15,6 +21,8 @@ pub struct Config {
     pub max_context: usize,
     pub max_predict: i8,
     pub threads: u8,
+    /// llama-server slots, each with its own KV cache of max_context tokens.
+    pub parallel: u8,
     pub gpu_layers: i32,
 }
 
@@ -24,12 +32,27 @@ pub struct AppState {
     pub model_type: ModelType,
     pub max_context: usize,
     pub max_predict: i8,
+    pub token_cache: TokenCache,
+    pub metrics: Metrics,
+    pub sessions: Sessions,
+    pub response_cache: ResponseCache,
+    pub slots: SlotAffinity,
+    pub window_starts: WindowStarts,
 }
 
 #[derive(Deserialize)]
 pub struct CompletionRequest {
     pub prefix: String,
     pub suffix: String,
+    /// Buffer the request comes from; keys the server's per-document caches.
+    pub document: Option<String>,
+    /// Client session (e.g. one editor); a newer request from the same
+    /// session aborts this one.
+    pub session: Option<String>,
+    /// Per-request overrides; must fit within the loaded model's ctx size.
+    pub max_context: Option<usize>,
+    pub max_predict: Option<i8>,
+    pub split_ratio: Option<f32>,
 }
 
 #[derive(Serialize)]
@@ -37,6 +60,29 @@ pub struct CompletionResponse {
     pub completion: String,
     pub prompt: String,
     pub latency_ms: u64,
+    pub timings: StageTimings,
+    /// Prefix and suffix tokens reused from the document's previous request.
+    pub tokens_reused: usize,
+    /// "exact" or "typeahead" when answered from recent completions without llama-server.
+    pub cache: Option<&'static str>,
+    /// llama-server slot the prompt was evaluated in.
+    pub slot: Option<usize>,
+    /// Prompt tokens llama-server reused from the slot's KV cache instead of evaluating.
+    pub prompt_tokens_cached: usize,
+}
+
+/// Wall-clock time spent in each stage of a completion request.
+#[derive(Serialize, Default)]
+pub struct StageTimings {
+    pub tokenize_ms: f64,
+    /// Prefix and suffix are tokenized concurrently; tokenize_ms is the wall time of both.
+    pub tokenize_prefix_ms: f64,
+    pub tokenize_suffix_ms: f64,
+    pub truncate_ms: f64,
+    pub generate_ms: f64,
+    /// Request start to the first generated text (streaming only).
+    #[serde(skip_serializing_if = "Option::is_none")]
+    pub first_token_ms: Option<f64>,
 }
 
 #[derive(Serialize)]
@@ -46,12 +92,42 @@ pub struct LlamaRequest {
     pub stop: Vec<String>,
     pub temperature: f32,
     pub seed: u32,
+    /// Reuse the slot's KV cache for the prompt prefix it shares with the last one.
+    pub cache_prompt: bool,
+    /// Slot to run in; -1 lets llama-server pick.
+    pub id_slot: i32,
+    pub stream: bool,
 }
 
 #[derive(Deserialize, Debug)]
 pub struct LlamaResponse {
     pub content: String,
+    /// Missing from intermediate stream events.
+    #[serde(default)]
     pub prompt: String,
+    /// Set on the last event of a stream.
+    #[serde(default)]
+    pub stop: bool,
+    /// Prompt tokens in the request, whether evaluated or taken from the KV cache.
+    #[serde(default)]
+    pub tokens_evaluated: usize,
+    pub timings: Option<LlamaTimings>,
+}
+
+#[derive(Deserialize, Debug)]
+pub struct LlamaTimings {
+    /// Prompt tokens actually evaluated.
+    pub prompt_n: usize,
+}
+
+impl LlamaResponse {
+    /// Prompt tokens reused from the slot's KV cache instead of evaluated.
+    ///
+    /// llama-server's own `tokens_cached` is the slot's n_past (prompt plus
+    /// generated tokens), so it says nothing about skipped prefill.
+    pub fn prompt_tokens_cached(&self) -> usize {
+        self.timings.as_ref().map_or(0, |t| self.tokens_evaluated.saturating_sub(t.prompt_n))
+    }
 }
 
 #[derive(Serialize)]
@@ -69,6 +145,31 @@ pub struct TokenizeResponse {
     pub tokens: Vec<u32>,
 }
 
+#[derive(Serialize)]
+pub struct TokenizePiecesRequest {
+    pub content: String,
+    pub with_pieces: bool,
+}
+
+/// A token piece is a string, or raw bytes when it is not valid UTF-8 on its own.
+#[derive(Deserialize, Debug)]
+#[serde(untagged)]
+pub enum Piece {
+    Text(String),
+    Bytes(Vec<u8>),
+}
+
+#[derive(Deserialize, Debug)]
+pub struct TokenPiece {
+    pub id: u32,
+    pub piece: Piece,
+}
+
+#[derive(Deserialize, Debug)]
+pub struct TokenizePiecesResponse {
+    pub tokens: Vec<TokenPiece>,
+}
+
 #[derive(Serialize)]
 pub struct DetokenizeRequest {
     pub tokens: Vec<u32>,